@@ -5,27 +5,45 @@ from markupsafe import (
     escape,
 )  # Cette bibliothèque permet de sécuriser des caractères spécifiques pour qu'ils ne soient pas interprétés de manière malveillante dans les chaînes HTML.
 import requests  # Utilisé pour envoyer des requêtes HTTP.
+import json  # Utilisé pour décoder le flux JSON-LD morceau par morceau.
+import codecs  # Utilisé pour décoder l'UTF-8 de manière incrémentale.
 from google.cloud import (
     bigquery,
 )  # Client pour interagir avec l'API BigQuery de Google.
 from datetime import datetime  # Utilisé pour manipuler les dates et les heures.
+from datetime import date
+import functools  # Utilisé pour mettre en cache les dates déjà lues.
 from google.cloud.bigquery import SchemaField
 from datetime import datetime
 import uuid  # Utilisé pour générer des identifiants uniques universels.
+import hashlib  # Utilisé pour les empreintes de l'index des doublons.
+import time
+import multiprocessing  # Utilisé pour adapter les événements sur plusieurs coeurs.
+from array import array  # Utilisé pour sauvegarder l'index des doublons sous forme binaire compacte.
+import os
+import tempfile  # Utilisé pour le fichier de préparation des jobs de chargement.
+import io
 from flask import (
     jsonify,
 )  # Utilisé pour formater les réponses à renvoyer en tant que JSON.
 
 # from sklearn.metrics.pairwise import cosine_similarity # Utilisé pour calculer la similitude cosinus entre les échantillons pour déterminer la similitude des textes.
 # from sklearn.feature_extraction.text import CountVectorizer # Transforme le texte en vecteur de tokens pour faciliter le calcul de la similarité.
+import unicodedata  # Utilisé pour retirer les accents lors de la normalisation des titres.
+import re
+import itertools
+import zlib  # Utilisé pour hacher les mots des titres (MinHash).
+import pandas as pd  # Utilisé pour catégoriser les événements par lots.
 import numpy as np  # Utilisé pour des calculs scientifiques et la manipulation de structures de données multidimensionnelles.
 import pgeocode
+from http_client import http_cache  # Cache HTTP partagé, sur le client à reprises et limitation par hôte.
 
 # ===================================================================================================
 # *                                         VARIABLES
 # ===================================================================================================
 
 # Mots interdits à définir
+# Les listes sont comparées après normalize_text : inutile d'y répéter les variantes sans accents
 blackList = [
     "contes",
     "théâtre",
@@ -51,7 +69,7 @@ blackList = [
     "collecte de sang",
     "cinéma",
     "goûter",
-    "concert njp",
+    "concert",
     "bien-être",
     "trail",
     "commémoratif",
@@ -67,55 +85,13 @@ blackList = [
     "téléthon",
     "trial",
     "art",
-    "contes",
-    "theatre",
-    "lecture",
-    "jeux de societe",
-    "opera",
-    "comedie",
-    "visite",
-    "exposition",
-    "conference",
-    "balade",
-    "promenade",
-    "randonnee",
-    "pedestre",
-    "jeux video",
-    "nature",
-    "theatralisee",
-    "livre",
-    "performance",
-    "running",
-    "crossfit",
-    "poesie",
-    "collecte de sang",
-    "cinema",
-    "gouter",
-    "concert",
-    "bien-etre",
-    "trail",
-    "commemoratif",
-    "tous en selle",
-    "ceremonie",
-    "projection",
-    "triathlon",
-    "jeu de piste",
-    "sortie nature",
-    "tresor",
-    "abbaye",
-    "portes ouvertes",
-    "telethon",
-    "trial",
-    "art",
 ]
 
 # Mots autorisés
 whiteList = [
     "fest-noz",
-    "fest noz",
     "fest",
-    "fest -deiz",
-    "fest deiz",
+    "fest-deiz",
     "feria",
     "carnaval",
     "guinguette",
@@ -125,28 +101,73 @@ whiteList = [
     "buvette",
     "buvettes",
     "fête",
-    "fete",
-    "fetes",
+    "fêtes",
     "fête de village",
     "fête du village",
     "fête communale",
     "fanfare",
     "marché nocturne",
-    "fanfare",
-    "feu de la saint jean",
-    "feu de la st jean",
-    "feu de la st-jean",
     "feu de la saint-jean",
+    "feu de la st-jean",
     "année 80",
     "années 80",
     "apéro",
-    "apero",
     "fête municipale",
     "fête de l'été",
     "fête vosgienne",
     "soirée vosgienne",
 ]
 
+# Mots essentiels servant de catégorie, par ordre de priorité
+essentialWords = [
+    "fest-noz",
+    "feria",
+    "carnaval",
+    "guinguette",
+    "festival",
+    "foire artisanale",
+    "fête du village",
+]
+
+# Dossier persistant pour l'état conservé d'une exécution à l'autre (par exemple un volume Cloud Storage monté
+# dans la Cloud Function). Sur Cloud Functions, /tmp est gardé en mémoire et perdu à chaque démarrage à froid.
+STATE_DIR = os.environ.get("STATE_DIR")
+
+# Fichier {code postal: région} chargé au démarrage pour éviter les recherches pgeocode, et réécrit à la fin
+# de chaque exécution ; dans STATE_DIR s'il est défini, sinon dans /tmp (conservé tant que l'instance reste active)
+REGION_CACHE_PATH = os.environ.get("REGION_CACHE_PATH") or os.path.join(
+    STATE_DIR or tempfile.gettempdir(), "regions.json"
+)
+
+# Index des "@id" déjà insérés, et nombre de jours avant de le réconcilier avec la table.
+# Il doit être dans un dossier persistant (STATE_DIR) : sans emplacement, l'index est reconstruit
+# à partir de la table à chaque exécution (un parcours complet des colonnes source et empreinte)
+DEDUPE_INDEX_PATH = os.environ.get("DEDUPE_INDEX_PATH") or (
+    os.path.join(STATE_DIR, "evenement_sources.idx") if STATE_DIR else None
+)
+DEDUPE_RECONCILE_DAYS = float(os.environ.get("DEDUPE_RECONCILE_DAYS", "7"))
+
+# Index des dates des événements (recherche par période, voir load_date_index). Comme l'index des doublons,
+# il doit être dans un dossier persistant (STATE_DIR)
+DATE_INDEX_PATH = os.environ.get("DATE_INDEX_PATH") or (
+    os.path.join(STATE_DIR, "evenement_dates.npz") if STATE_DIR else None
+)
+
+# Index géographique des événements à venir, lu par le service de recherche par lieu
+GEO_INDEX_PATH = os.environ.get(
+    "GEO_INDEX_PATH", os.path.join(tempfile.gettempdir(), "evenement_geo.npz")
+)
+
+# Point de reprise des exécutions interrompues, âge maximal (heures) au-delà duquel il est ignoré,
+# et durée maximale (secondes) d'une exécution avant de s'arrêter proprement (0 pour ne pas limiter).
+# L'exécution suivante tourne souvent sur une autre instance : le point de reprise doit être dans un dossier
+# persistant (STATE_DIR). Sans emplacement, les exécutions ne sont pas reprises et la durée n'est pas limitée
+CHECKPOINT_PATH = os.environ.get("CHECKPOINT_PATH") or (
+    os.path.join(STATE_DIR, "ingestion_checkpoint.json") if STATE_DIR else None
+)
+CHECKPOINT_MAX_AGE_HOURS = float(os.environ.get("CHECKPOINT_MAX_AGE_HOURS", "24"))
+RUN_TIME_BUDGET = float(os.environ.get("RUN_TIME_BUDGET", "0"))
+
 # ===================================================================================================
 # *                                         API#2 DATATOURISME
 # ===================================================================================================
@@ -163,8 +184,8 @@ def fetch(url):
         data (dict): Un dictionnaire contenant les données du fichier JSON-LD.
     """
     try:
-        # Récupéeration du fichier JSON-LD
-        response = requests.get(url)
+        # Récupéeration du fichier JSON-LD (relu depuis le cache s'il n'a pas changé)
+        response = http_cache.get(url)
         response.raise_for_status()
         data = response.json()
 
@@ -179,15 +200,160 @@ def fetch(url):
     return data
 
 
+# ===================================================================================================
+#                                        STREAM_GRAPH
+# ===================================================================================================
+
+
+class _JsonStream:
+    """
+    Lecteur JSON incrémental : décode des valeurs JSON successives à partir de morceaux de texte,
+    en ne gardant en mémoire que la valeur en cours de lecture.
+    """
+
+    def __init__(self, chunks):
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder("utf-8")()
+        self._json = json.JSONDecoder()
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        # Ajoute le morceau suivant au tampon, en oubliant la partie déjà lue
+        if self.eof:
+            return False
+        try:
+            chunk = next(self._chunks)
+            text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+        except StopIteration:
+            text = self._decoder.decode(b"", final=True)
+            self.eof = True
+        self.buffer = self.buffer[self.pos :] + text
+        self.pos = 0
+        return True
+
+    def peek(self):
+        # Renvoie le prochain caractère significatif ("" en fin de flux)
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if not self._fill():
+                return ""
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"'{char}' attendu, '{found}' trouvé à la position {self.pos}")
+        self.pos += 1
+
+    def value(self):
+        self.peek()
+        while True:
+            try:
+                obj, end = self._json.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Valeur incomplète : on lit le morceau suivant
+                if not self._fill():
+                    raise
+                continue
+            # Un nombre en fin de tampon peut se poursuivre dans le morceau suivant
+            if end == len(self.buffer) and not self.eof:
+                self._fill()
+                continue
+            self.pos = end
+            return obj
+
+
+def iter_graph_nodes(chunks):
+    """
+    Cette fonction lit un document JSON-LD morceau par morceau et renvoie un à un les noeuds du tableau "@graph",
+    sans jamais charger le document entier en mémoire.
+
+    Args:
+        chunks (iterable): Morceaux successifs (bytes ou str) du document JSON-LD.
+
+    Yields:
+        dict: Chaque noeud du tableau "@graph".
+    """
+    stream = _JsonStream(chunks)
+    stream.expect("{")
+    if stream.peek() == "}":
+        return
+
+    while True:
+        key = stream.value()
+        stream.expect(":")
+
+        if key == "@graph":
+            stream.expect("[")
+            if stream.peek() == "]":
+                stream.pos += 1
+            else:
+                while True:
+                    yield stream.value()
+                    separator = stream.peek()
+                    if separator not in (",", "]"):
+                        raise ValueError(f"',' ou ']' attendu dans @graph, '{separator}' trouvé")
+                    stream.pos += 1
+                    if separator == "]":
+                        break
+        else:
+            # Les autres clés ("@context", ...) sont lues puis ignorées
+            stream.value()
+
+        if stream.peek() == "}":
+            return
+        stream.expect(",")
+
+
+def stream_graph(url, chunk_size=1 << 16):
+    """
+    Cette fonction télécharge le fichier JSON-LD à l'URL spécifiée en streaming et renvoie ses noeuds "@graph"
+    au fur et à mesure de leur réception. La mémoire utilisée ne dépend pas de la taille du flux.
+
+    Args:
+        url (str): L'URL du fichier JSON-LD.
+        chunk_size (int): Taille en octets des morceaux lus dans le corps de la réponse HTTP.
+
+    Yields:
+        dict: Chaque noeud du tableau "@graph".
+
+    Raises:
+        requests.exceptions.RequestException: Si le téléchargement échoue, même en cours de route.
+        ValueError: Si le document est invalide ou tronqué (le "]" et le "}" finaux n'ont pas été lus).
+    """
+    # Les erreurs sont affichées puis relancées : un flux interrompu ne doit pas passer pour un flux terminé
+    try:
+        chunks = http_cache.iter_content(url, chunk_size=chunk_size)
+        yield from iter_graph_nodes(chunks)
+        # Lit la fin du corps pour que le cache l'enregistre en entier
+        for _ in chunks:
+            pass
+
+    except requests.exceptions.RequestException as e:
+        print(f"Error while fetching data: {e}")
+        raise
+
+    except ValueError as ve:
+        print(f"Error decoding JSON response: {ve}")
+        raise
+
+
 # ===================================================================================================
 #                                        ADAPT_EVENT
 # ===================================================================================================
-def adapt_event(event):
+def adapt_event(event, resolve_regions=True, keywords=None):
     """
     Cette fonction adapte les données de l'événement pour être insérées dans BigQuery.
 
     Args:
         event (dict): Un dictionnaire contenant les détails de l'événement.
+        resolve_regions (bool): False pour laisser la région à None quand DATAtourisme ne la fournit pas,
+            afin qu'elle soit résolue ensuite pour tout un lot par enrich_regions.
+        keywords (tuple): Résultat de keyword_matcher.match déjà calculé par prefilter_events, sinon None.
 
     Returns:
         adapted_event (dict) or None: Un dictionnaire contenant les détails de l'événement adaptés pour BigQuery, ou None si l'événement contient un mot de la liste noire dans son titre.
@@ -203,15 +369,21 @@ def adapt_event(event):
     # Récupération du titre
     titre = event["rdfs:label"].get("@value", None)
 
-    if not whitelist(titre, whiteList):
+    # Le titre est normalisé une seule fois, puis liste blanche, liste noire et catégorie
+    # sont évaluées en un seul passage
+    if keywords is None:
+        keywords = keyword_matcher.match(normalize_text(titre))
+    autorise, interdit, categorie = keywords
+
+    if not autorise:
         return None, event
 
     # Si le titre de l'événement contient un mot de la liste noire, retourne None
-    if blacklist(titre, blackList):
+    if interdit:
         return None, event
 
-    # Création d'un identifiant unique pour chaque événement avec uuid
-    unique_id = str(uuid.uuid4())
+    # Création d'un identifiant unique et stable pour chaque événement, dérivé de sa source
+    unique_id = event_id(event.get("@id", None))
 
     # Récupération et adaptation d'autres éléments de données pour correspondre à la structure de la table BigQuery
     ressource = None
@@ -233,8 +405,6 @@ def adapt_event(event):
     date_debut = retrieve_date(event, "schema:startDate")
     date_fin = retrieve_date(event, "schema:endDate")
 
-    nomi = pgeocode.Nominatim("fr")
-
     # Récupération de la ville, du code postal et de la région
     ville = None
     code_postal = None
@@ -254,9 +424,6 @@ def adapt_event(event):
             else:
                 code_postal = address["schema:postalCode"]
 
-        region = nomi.query_postal_code(code_postal)
-        region = region["state_name"]
-
         if (
             "hasAddressCity" in address
             and "isPartOfRegion" in address["hasAddressCity"]
@@ -265,12 +432,16 @@ def adapt_event(event):
             if "rdfs:label" in region_info and "@value" in region_info["rdfs:label"]:
                 region = region_info["rdfs:label"]["@value"]
 
+        # La région n'est recherchée à partir du code postal que si DATAtourisme ne la fournit pas
+        if region is None and resolve_regions:
+            region = resolve_region(code_postal)
+
     # If ville is still None, return None, event
     if ville is None:
         return None, event
     if code_postal is None:
         code_postal = "Inconnu"
-    if region is None:
+    if region is None and resolve_regions:
         region = "Inconnue"
 
     # Vérification et récupération de la latitude et la longitude
@@ -294,8 +465,6 @@ def adapt_event(event):
     if "rdfs:comment" in event and "@value" in event["rdfs:comment"]:
         description = event["rdfs:comment"]["@value"]
 
-    categorie = get_categorie(titre)
-
     # Création d'un dictionnaire avec les données adaptées
     adapted_event = {
         "id": unique_id,
@@ -319,539 +488,2640 @@ def adapt_event(event):
 
 
 # ===================================================================================================
-#                                      RETRIEVE_DATE
+#                                          EVENT_ID
 # ===================================================================================================
-def retrieve_date(event, date_key):
+
+
+def event_id(source):
     """
-    Cette fonction extrait une date d'un événement en fonction de la clé de la date donnée.
+    Cette fonction calcule l'identifiant d'un événement à partir de l'URI de sa source (DATAtourisme ou OpenAgenda) :
+    un UUID version 5, toujours le même pour une même source. Les réinsertions et les nouvelles tentatives
+    sont ainsi idempotentes (voir les row_ids de BigQueryWriter).
 
     Args:
-        event (dict): L'événement d'où la date est à extraire.
-        date_key (str): La clé utilisée pour récupérer la date dans l'événement.
+        source (str): L'URI de la source de l'événement ("@id" DATAtourisme par exemple).
 
     Returns:
-        str: Une représentation string de la date au format DD-MM-YYYY si elle est trouvée, sinon None.
+        str: L'identifiant de l'événement, ou un UUID aléatoire si la source est inconnue.
     """
-    if date_key in event:
-        if isinstance(event[date_key], list):
-            for date_obj in event[date_key]:
-                if "@value" in date_obj:
-                    date_str = date_obj["@value"]
-                    if "T" in date_str:
-                        return (
-                            datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-                            .date()
-                            .isoformat()
-                        )
-                    else:
-                        return (
-                            datetime.strptime(date_str, "%Y-%m-%d").date().isoformat()
-                        )
-        else:
-            date_str = event[date_key].get("@value", None)
-            if date_str is not None:
-                if "T" in date_str:
-                    return (
-                        datetime.strptime(date_str, "%Y-%m-%dT%H:%M:%S")
-                        .date()
-                        .isoformat()
-                    )
-                else:
-                    return datetime.strptime(date_str, "%Y-%m-%d").date().isoformat()
-    return None
+    if not source:
+        return str(uuid.uuid4())
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, source))
 
 
 # ===================================================================================================
-#                                      CHECK_FOR_DUPLICATES
+#                                        SHARD_OF
 # ===================================================================================================
 
 
-def check_for_duplicates():
+def shard_of(source, shard_count):
     """
-    Cette fonction vérifie si un événement est un doublon en le comparant avec les événements existants dans la base de données.
-    Utilise une structure de données Set pour un accès plus rapide.
+    Cette fonction attribue un événement à une partition à partir de l'URI de sa source : le même "@id"
+    tombe toujours dans la même partition, quels que soient l'instance et l'ordre du flux.
+    Plusieurs instances peuvent ainsi se partager un flux sans se coordonner ni créer de doublons.
+
+    Args:
+        source (str): L'URI de la source de l'événement ("@id" DATAtourisme).
+        shard_count (int): Nombre de partitions.
 
     Returns:
-        set: Ensemble des identifiants des événements déjà présents dans la base de données.
+        int: L'indice de la partition, entre 0 et shard_count - 1 (0 si la source est inconnue).
     """
-    client = bigquery.Client()
-    dataset_id = "festa"
-    table_id = "evenement"
-    query = f"SELECT source FROM `{dataset_id}.{table_id}`"
-    result = client.query(query).result()
-    # Transforme le résultat en un ensemble (set) pour une vérification plus rapide des doublons
-    existing_ids = set(row.get("source", "") for row in result)
-    return existing_ids
-
-
-# ===================================================================================================
-#                                      INSERT_INTO_BIGQUERY
-# ===================================================================================================
+    if not source or shard_count <= 1:
+        return 0
+    digest = hashlib.blake2b(source.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shard_count
 
 
-def insert_into_bigquery(event):
+def shard_path(path, shard_index=0, shard_count=1):
     """
-    Cette fonction insère un événement dans une table spécifique de BigQuery s'il n'est pas un doublon.
+    Cette fonction renvoie le fichier d'état (index, point de reprise) propre à une partition, pour que des instances
+    exécutées en même temps n'écrasent pas les fichiers les unes des autres.
 
     Args:
-        event (dict): L'événement à insérer dans la table BigQuery.
+        path (str): Le fichier commun, ou None.
+        shard_index (int): Indice de la partition.
+        shard_count (int): Nombre de partitions.
 
+    Returns:
+        str: "<racine>.<shard_index>-<shard_count><extension>", ou `path` tel quel sans partitionnement.
     """
+    if not path or shard_count <= 1:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{shard_index}-{shard_count}{ext}"
 
-    try:
-        # Utiliser les informations d'identification par défaut
-        client = bigquery.Client()
 
-        # Spécifiez votre dataset et table BigQuery
-        dataset_id = "festa"
-        table_id = "evenement"
+# ===================================================================================================
+#                                      FINGERPRINT_EVENT
+# ===================================================================================================
 
-        table_ref = client.dataset(dataset_id).table(table_id)
-        table = client.get_table(table_ref)
+# Colonnes qui ne décrivent pas le contenu de l'événement et sont exclues de l'empreinte
+UNFINGERPRINTED_FIELDS = {"id", "score", "ts_entree", "empreinte"}
 
-        rows_to_insert = [
-            event,
-        ]
 
-        errors = client.insert_rows_json(table, rows_to_insert)  # Requête API
+def fingerprint_event(adapted_event):
+    """
+    Cette fonction calcule une empreinte stable du contenu d'un événement adapté : un hachage blake2b de 8 octets
+    de ses colonnes (hors id, score, ts_entree) sérialisées en JSON avec des clés triées.
 
-        if errors != []:
-            print(errors)
-            raise Exception(
-                "Une erreur s'est produite lors de l'insertion des lignes dans BigQuery."
-            )
+    Args:
+        adapted_event (dict): L'événement adapté par adapt_event.
 
-    except Exception as e:
-        print(f"Une erreur s'est produite : {e}")
+    Returns:
+        str: L'empreinte en hexadécimal (16 caractères), stockée dans la colonne empreinte.
+    """
+    content = {
+        key: value
+        for key, value in adapted_event.items()
+        if key not in UNFINGERPRINTED_FIELDS
+    }
+    serialized = json.dumps(
+        content, ensure_ascii=False, sort_keys=True, separators=(",", ":"), default=str
+    )
+    return hashlib.blake2b(serialized.encode("utf-8"), digest_size=8).hexdigest()
 
 
 # ===================================================================================================
-#                                       DELETE_EXPIRED_EVENTS
+#                                      RESOLVE_REGION
 # ===================================================================================================
 
+# Instance pgeocode partagée, créée au premier besoin (la lecture de la base postale est coûteuse)
+_nominatim = None
+
+# Cache des régions déjà résolues : code postal -> nom de la région (ou None si inconnu)
+_region_cache = {}
 
-def delete_expired_events():
+
+def get_nominatim():
     """
-    Cette fonction supprime tous les événements de la table BigQuery dont la date de début est strictement inférieure à la date actuelle.
+    Cette fonction renvoie l'instance pgeocode pour la France, créée une seule fois par processus.
 
+    Returns:
+        pgeocode.Nominatim: Le géocodeur français.
     """
+    global _nominatim
+    if _nominatim is None:
+        _nominatim = pgeocode.Nominatim("fr")
+    return _nominatim
 
-    # Utiliser les informations d'identification par défaut
-    client = bigquery.Client()
 
-    # Spécifiez votre dataset et table BigQuery
-    dataset_id = "festa"
-    table_id = "evenement"
+def resolve_region(code_postal):
+    """
+    Cette fonction renvoie la région correspondant à un code postal. Chaque code postal n'est recherché
+    qu'une seule fois dans pgeocode, les appels suivants sont servis par le cache.
 
-    # Obtenir la date actuelle
-    date_actuelle = datetime.now().date().isoformat()
+    Args:
+        code_postal (str): Le code postal à résoudre.
 
-    # Construction de la requête pour compter les événements à supprimer
-    query_count = f"""
-        SELECT COUNT(*)
-        FROM `{dataset_id}.{table_id}`
-        WHERE date_fin < DATE '{date_actuelle}' AND DATE(ts_entree) < DATE '{date_actuelle}'
+    Returns:
+        str: Le nom de la région, ou None si le code postal est absent ou inconnu.
     """
+    if code_postal is None:
+        return None
 
-    # Exécution de la requête de comptage
-    query_job = client.query(query_count)  # API request
-    result = query_job.result()
-
-    # Récupération du nombre d'événements à supprimer
-    for row in result:
-        count_before = row[0]
+    if code_postal not in _region_cache:
+        region = get_nominatim().query_postal_code(code_postal)["state_name"]
+        # pgeocode renvoie NaN pour un code postal inconnu
+        _region_cache[code_postal] = region if isinstance(region, str) else None
+    return _region_cache[code_postal]
 
-    print(f"Il y a {count_before} événements qui vont être supprimés.")
 
-    # Construction de la requête de suppression
-    query_delete = f"""
-        DELETE FROM `{dataset_id}.{table_id}`
-        WHERE date_fin < DATE '{date_actuelle}' AND DATE(ts_entree) < DATE '{date_actuelle}'
+def prewarm_region_cache(path):
     """
+    Cette fonction remplit le cache des régions à partir d'un fichier JSON {code postal: région},
+    par exemple produit par save_region_cache lors d'une exécution précédente.
 
-    # Exécution de la requête de suppression
-    query_job = client.query(query_delete)  # API request
-    result = query_job.result()
-
-    # Exécution de nouveau la requête de comptage
-    query_job = client.query(query_count)  # API request
-    result = query_job.result()
-
-    # Récupération du nombre d'événements après la suppression
-    for row in result:
-        count_after = row[0]
+    Args:
+        path (str): Chemin du fichier JSON.
 
-    print(f"Il y a maintenant {count_after} événements concernés après la suppression.")
-    print(
-        "Les événements avec une date de début inférieure à la date actuelle ont été supprimés."
-    )
+    Returns:
+        int: Nombre de codes postaux chargés (0 si le fichier n'existe pas).
+    """
+    if not os.path.exists(path):
+        return 0
+    with open(path, encoding="utf-8") as f:
+        regions = json.load(f)
+    _region_cache.update(regions)
+    return len(regions)
 
 
-# ===================================================================================================
-#                                          WHITELIST
-# ===================================================================================================
-def whitelist(event_title, list_words):
+def enrich_regions(adapted_events):
     """
-    Cette fonction vérifie si l'événement doit être retenu en fonction du titre.
-    Chaque élément dans list_words est considéré en entier.
+    Cette fonction complète la région d'un lot d'événements adaptés avec resolve_regions=False.
+    Tous les codes postaux inconnus du cache sont résolus par une seule requête vectorisée pgeocode,
+    au lieu d'une requête par événement. Les régions fournies par DATAtourisme (isPartOfRegion) sont conservées.
 
     Args:
-        event_title (str): Le titre de l'événement.
-        list_words (list): Une liste de mots ou groupes de mots à vérifier.
+        adapted_events (list): Les événements adaptés, modifiés sur place.
 
     Returns:
-        bool: True si l'événement doit être retenu, False sinon.
+        list: Les mêmes événements, avec une région renseignée.
     """
-    lower_event_title = event_title.lower()
-    title_words = lower_event_title.split()
+    missing = {
+        event["cp"]
+        for event in adapted_events
+        if event["region"] is None
+        and event["cp"] != "Inconnu"
+        and event["cp"] not in _region_cache
+    }
 
-    for word_group in list_words:
-        words = word_group.lower().split()
-        for i in range(len(title_words) - len(words) + 1):
-            if title_words[i : i + len(words)] == words:
-                return True
-    return False
+    if missing:
+        postal_codes = sorted(missing)
+        states = get_nominatim().query_postal_code(postal_codes)["state_name"]
+        for code_postal, region in zip(postal_codes, states):
+            _region_cache[code_postal] = region if isinstance(region, str) else None
 
+    for event in adapted_events:
+        if event["region"] is None:
+            event["region"] = _region_cache.get(event["cp"]) or "Inconnue"
+    return adapted_events
 
-# ===================================================================================================
-#                                          BLACKLIST
-# ===================================================================================================
-def blacklist(event_title, list):
+
+def save_region_cache(path):
     """
-    Cette fonction vérifie si l'événement doit être ignoré en fonction du titre.
+    Cette fonction enregistre le cache des régions dans un fichier JSON {code postal: région}.
+
     Args:
-        event_title (str): Le titre de l'événement.
-        list (list): Une liste de mots interdits.
+        path (str): Chemin du fichier JSON.
 
     Returns:
-        bool: True si l'événement doit être ignoré, False sinon.
+        int: Nombre de codes postaux enregistrés.
     """
-    event_title_words = event_title.lower().split()
-    for word in event_title_words:
-        if word in list:
-            return True
-    return False
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(_region_cache, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    return len(_region_cache)
 
 
 # ===================================================================================================
-#                                          GET_CATEGORIE
+#                                      RETRIEVE_DATE
 # ===================================================================================================
-def get_categorie(title):
+@functools.lru_cache(maxsize=1 << 16)
+def parse_date(date_str):
     """
-    Cette fonction répère le mot essentiel dans un titre.
+    Cette fonction lit la date (jour) d'une chaîne ISO 8601 : "2024-07-14", "2024-07-14T20:00:00",
+    "2024-07-14T20:00:00+02:00", "2024-07-14T18:00:00Z"... Le jour renvoyé est celui écrit dans la chaîne
+    (heure locale de l'événement), sans conversion de fuseau horaire.
+
+    Le cas courant est lu par découpage de la chaîne, bien plus vite que strptime ; les autres formats passent
+    par datetime.fromisoformat. Les résultats sont mis en cache : un même flux répète souvent les mêmes dates,
+    et chaque date d'un événement est relue par l'adaptation, les index et le calcul de similarité.
 
     Args:
-        title (str): Le titre à analyser.
+        date_str (str): La date à lire.
 
     Returns:
-        str: Le mot essentiel trouvé dans le titre, sinon "Autre".
+        date: La date, ou None si la chaîne n'est pas une date valide.
     """
+    if not isinstance(date_str, str):
+        return None
+    if (
+        len(date_str) >= 10
+        and date_str[4] == "-"
+        and date_str[7] == "-"
+        and (len(date_str) == 10 or date_str[10] in "T ")
+        and date_str[:4].isdigit()
+        and date_str[5:7].isdigit()
+        and date_str[8:10].isdigit()
+    ):
+        try:
+            return date(int(date_str[:4]), int(date_str[5:7]), int(date_str[8:10]))
+        except ValueError:
+            return None
+    try:
+        return datetime.fromisoformat(date_str.replace("Z", "+00:00")).date()
+    except ValueError:
+        return None
 
-    # Liste des mots essentiels
-    essential_words = [
-        "fest-noz",
-        "feria",
-        "carnaval",
-        "guinguette",
-        "festival",
-        "foire artisanale",
-        "fête du village",
-    ]
 
-    # Convertir le titre en minuscules
-    lower_title = title.lower()
+def retrieve_date(event, date_key):
+    """
+    Cette fonction extrait une date d'un événement en fonction de la clé de la date donnée.
 
-    # Parcourir chaque phrase dans essential_words
-    for phrase in essential_words:
-        # Vérifier si la phrase est dans le titre
-        if phrase in lower_title:
-            return phrase
+    Args:
+        event (dict): L'événement d'où la date est à extraire.
+        date_key (str): La clé utilisée pour récupérer la date dans l'événement.
 
-    # Si aucune phrase essentielle n'a été trouvée, retourner "Autre"
-    return "autre"
+    Returns:
+        str: Une représentation string de la date au format YYYY-MM-DD si elle est trouvée et valide, sinon None.
+    """
+    if date_key in event:
+        if isinstance(event[date_key], list):
+            for date_obj in event[date_key]:
+                if "@value" in date_obj:
+                    parsed = parse_date(date_obj["@value"])
+                    return parsed.isoformat() if parsed else None
+        else:
+            parsed = parse_date(event[date_key].get("@value", None))
+            return parsed.isoformat() if parsed else None
+    return None
 
 
 # ===================================================================================================
-#                                          TEST DE SIMILARITE
+#                                      CHECK_FOR_DUPLICATES
 # ===================================================================================================
 
 
-def jaccard_similarity(list1, list2):
+def check_for_duplicates():
     """
-    Cette fonction calcule la similarité de Jaccard entre deux listes.
-
-    Args:
-        list1 (list): Première liste à comparer.
-        list2 (list): Deuxième liste à comparer.
+    Cette fonction vérifie si un événement est un doublon en le comparant avec les événements existants dans la base de données.
+    Utilise une structure de données Set pour un accès plus rapide.
 
     Returns:
-        float: Score de similarité de Jaccard entre les deux listes.
+        set: Ensemble des identifiants des événements déjà présents dans la base de données.
     """
-    s1 = set(list1)
-    s2 = set(list2)
-    return len(s1.intersection(s2)) / len(s1.union(s2))
+    client = bigquery.Client()
+    dataset_id = "festa"
+    table_id = "evenement"
+    query = f"SELECT source FROM `{dataset_id}.{table_id}`"
+    result = client.query(query).result()
+    # Transforme le résultat en un ensemble (set) pour une vérification plus rapide des doublons
+    existing_ids = set(row.get("source", "") for row in result)
+    return existing_ids
+
+
+# ===================================================================================================
+#                                         DEDUPE_INDEX
+# ===================================================================================================
+
+
+class DedupeIndex:
+    """
+    Cette classe garde en mémoire les "@id" des événements déjà insérés sous forme d'empreintes blake2b de 8 octets,
+    chacun associé à l'empreinte du contenu de l'événement (colonne empreinte, voir fingerprint_event),
+    et se sauvegarde dans un petit fichier binaire. Charger ce fichier remplace le parcours complet de la colonne
+    source de la table à chaque exécution.
+
+    S'utilise comme l'ensemble renvoyé par check_for_duplicates : `source in index`.
+
+    Args:
+        sources (iterable): Identifiants ("@id") à ajouter à l'index (sans empreinte de contenu).
+    """
+
+    # En-tête du fichier ; les fichiers sans en-tête ne contiennent que les identifiants
+    MAGIC = b"FESTIDX2"
+
+    def __init__(self, sources=()):
+        self._keys = {}
+        self.update(sources)
+
+    @staticmethod
+    def key(source):
+        return int.from_bytes(
+            hashlib.blake2b(source.encode("utf-8"), digest_size=8).digest(), "little"
+        )
+
+    def __contains__(self, source):
+        return source is not None and self.key(source) in self._keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def add(self, source, empreinte=None):
+        """
+        Ajoute ou met à jour un événement.
+
+        Args:
+            source (str): L'identifiant ("@id") de l'événement.
+            empreinte (str): Empreinte hexadécimale du contenu, None si inconnue.
+        """
+        if source is not None:
+            self._keys[self.key(source)] = int(empreinte, 16) if empreinte else 0
+
+    def update(self, sources):
+        for source in sources:
+            self.add(source)
+
+    def record(self, rows):
+        """
+        Enregistre des lignes écrites avec succès (à utiliser comme on_success d'un EventWriter).
+
+        Args:
+            rows (list): Les lignes adaptées, avec leurs colonnes source et empreinte.
+        """
+        for row in rows:
+            self.add(row.get("source"), row.get("empreinte"))
+
+    def empreinte(self, source):
+        """
+        Renvoie l'empreinte de contenu connue pour un événement.
+
+        Args:
+            source (str): L'identifiant ("@id") de l'événement.
+
+        Returns:
+            str: L'empreinte hexadécimale, ou None si l'événement ou son empreinte sont inconnus.
+        """
+        value = self._keys.get(self.key(source), 0) if source is not None else 0
+        return format(value, "016x") if value else None
+
+    def save(self, path):
+        """
+        Sauvegarde l'index dans un fichier (écriture atomique).
+
+        Args:
+            path (str): Chemin du fichier.
+        """
+        pairs = array("Q")
+        for key in sorted(self._keys):
+            pairs.append(key)
+            pairs.append(self._keys[key])
+
+        # Nom temporaire unique : plusieurs instances peuvent partager le dossier d'état
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self.MAGIC)
+            pairs.tofile(f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Charge un index sauvegardé par save.
+
+        Args:
+            path (str): Chemin du fichier.
+
+        Returns:
+            DedupeIndex: L'index chargé.
+        """
+        with open(path, "rb") as f:
+            data = f.read()
+
+        values = array("Q")
+        index = cls()
+        if data.startswith(cls.MAGIC):
+            values.frombytes(data[len(cls.MAGIC) :])
+            index._keys = dict(zip(values[0::2], values[1::2]))
+        else:
+            values.frombytes(data)
+            index._keys = dict.fromkeys(values, 0)
+        return index
+
+
+def reconcile_dedupe_index(path=None, shard_index=0, shard_count=1):
+    """
+    Cette fonction reconstruit l'index des doublons à partir de la table BigQuery (un seul parcours des colonnes
+    source et empreinte) et le sauvegarde. Elle corrige les écarts éventuels (suppressions, insertions faites
+    hors de cette fonction, par exemple par les autres partitions).
+
+    Args:
+        path (str): Chemin du fichier d'index, DEDUPE_INDEX_PATH (propre à la partition) si None
+            (l'index n'est pas sauvegardé si aucun emplacement n'est configuré).
+        shard_index (int): Indice de la partition : seules ses sources sont gardées (voir shard_of).
+        shard_count (int): Nombre de partitions.
+
+    Returns:
+        DedupeIndex: L'index reconstruit.
+    """
+    path = path or shard_path(DEDUPE_INDEX_PATH, shard_index, shard_count)
+    client = bigquery.Client()
+    # La colonne empreinte n'existe qu'une fois la table migrée pour la détection des modifications
+    schema = client.get_table("festa.evenement").schema
+    if any(field.name == "empreinte" for field in schema):
+        query = "SELECT source, empreinte FROM `festa.evenement`"
+    else:
+        query = "SELECT source, NULL AS empreinte FROM `festa.evenement`"
+
+    index = DedupeIndex()
+    for row in client.query(query).result():
+        if shard_of(row.get("source"), shard_count) == shard_index:
+            index.add(row.get("source"), row.get("empreinte"))
+    if path:
+        index.save(path)
+    print(f"Index des doublons reconstruit : {len(index)} événements.")
+    return index
+
+
+def load_dedupe_index(path=None, max_age_days=None, shard_index=0, shard_count=1):
+    """
+    Cette fonction charge l'index des doublons depuis son fichier. Si le fichier n'existe pas encore ou date de plus
+    de max_age_days jours, l'index est d'abord réconcilié avec la table BigQuery.
+
+    Le fichier doit être dans un dossier persistant (DEDUPE_INDEX_PATH ou STATE_DIR) : s'il n'y en a pas,
+    l'index est reconstruit à chaque exécution, ce qui coûte un parcours de la table comme check_for_duplicates.
+
+    Args:
+        path (str): Chemin du fichier d'index, DEDUPE_INDEX_PATH (propre à la partition) si None.
+        max_age_days (float): Âge maximal du fichier avant réconciliation, DEDUPE_RECONCILE_DAYS si None.
+        shard_index (int): Indice de la partition ; par défaut, chaque partition a son propre fichier (voir shard_path).
+        shard_count (int): Nombre de partitions.
+
+    Returns:
+        DedupeIndex: L'index des événements déjà présents.
+    """
+    path = path or shard_path(DEDUPE_INDEX_PATH, shard_index, shard_count)
+    max_age_days = DEDUPE_RECONCILE_DAYS if max_age_days is None else max_age_days
+
+    if not path:
+        print("Aucun emplacement persistant pour l'index des doublons (STATE_DIR) : reconstruction complète.")
+        return reconcile_dedupe_index(path, shard_index, shard_count)
+    if (
+        not os.path.exists(path)
+        or time.time() - os.path.getmtime(path) > max_age_days * 86400
+    ):
+        return reconcile_dedupe_index(path, shard_index, shard_count)
+    return DedupeIndex.load(path)
+
+
+# ===================================================================================================
+#                                      INSERT_INTO_BIGQUERY
+# ===================================================================================================
+
+
+def insert_into_bigquery(event):
+    """
+    Cette fonction insère un événement dans une table spécifique de BigQuery s'il n'est pas un doublon.
+
+    Args:
+        event (dict): L'événement à insérer dans la table BigQuery.
+
+    """
+
+    try:
+        # Utiliser les informations d'identification par défaut
+        client = bigquery.Client()
+
+        # Spécifiez votre dataset et table BigQuery
+        dataset_id = "festa"
+        table_id = "evenement"
+
+        table_ref = client.dataset(dataset_id).table(table_id)
+        table = client.get_table(table_ref)
+
+        rows_to_insert = [
+            event,
+        ]
+
+        errors = client.insert_rows_json(
+            table, rows_to_insert, row_ids=[event.get("id")]
+        )  # Requête API
+
+        if errors != []:
+            print(errors)
+            raise Exception(
+                "Une erreur s'est produite lors de l'insertion des lignes dans BigQuery."
+            )
+
+    except Exception as e:
+        print(f"Une erreur s'est produite : {e}")
+
+
+# ===================================================================================================
+#                                        BIGQUERY_WRITER
+# ===================================================================================================
+
+
+class EventWriter:
+    """
+    Classe de base des écrivains d'événements : insert() ajoute une ligne, flush() envoie ce qui est en attente,
+    close() termine l'écriture et abort() l'abandonne après une erreur. Toutes s'utilisent comme gestionnaires
+    de contexte : close() à la sortie normale du bloc, abort() si une exception en sort.
+
+    Args:
+        on_success (callable): Fonction appelée avec la liste des lignes écrites avec succès, après chaque envoi.
+
+    Attributs:
+        inserted (int): Nombre de lignes écrites avec succès.
+        requests (int): Nombre de requêtes (ou de jobs) envoyés.
+        errors (list): Liste de (ligne, erreurs) pour chaque ligne refusée.
+    """
+
+    def __init__(self, on_success=None):
+        self.on_success = on_success
+        self.inserted = 0
+        self.requests = 0
+        self.errors = []
+
+    def _succeeded(self, rows):
+        self.inserted += len(rows)
+        if self.on_success is not None and rows:
+            self.on_success(rows)
+
+    def insert(self, row):
+        raise NotImplementedError
+
+    def flush(self):
+        return []
+
+    def close(self):
+        return self.flush()
+
+    def abort(self):
+        # Par défaut, les lignes déjà reçues sont valides et sont envoyées malgré l'erreur
+        return self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+        return False
+
+
+class BigQueryWriter(EventWriter):
+    """
+    Cette classe insère des événements dans BigQuery par lots, en réutilisant un seul client et une seule table.
+    Les lignes sont mises en tampon et envoyées avec un seul insert_rows_json dès que le lot atteint
+    max_rows lignes ou max_bytes octets, puis une dernière fois à la fermeture.
+
+    S'utilise comme un gestionnaire de contexte :
+
+        with BigQueryWriter() as writer:
+            for event in events:
+                writer.insert(event)
+
+    Args:
+        dataset_id (str): Le dataset BigQuery.
+        table_id (str): La table BigQuery.
+        client (bigquery.Client): Client à réutiliser, créé si None.
+        max_rows (int): Nombre maximal de lignes par requête.
+        max_bytes (int): Taille maximale (JSON encodé) d'un lot, en octets.
+        on_success (callable): Voir EventWriter.
+    """
+
+    def __init__(
+        self,
+        dataset_id="festa",
+        table_id="evenement",
+        client=None,
+        max_rows=500,
+        max_bytes=5_000_000,
+        on_success=None,
+    ):
+        super().__init__(on_success)
+        self.client = client if client is not None else bigquery.Client()
+        self.table = self.client.get_table(self.client.dataset(dataset_id).table(table_id))
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+
+        self._rows = []
+        self._bytes = 0
+
+    def insert(self, row):
+        """
+        Ajoute une ligne au lot courant et envoie le lot s'il est plein.
+
+        Args:
+            row (dict): La ligne à insérer.
+
+        Returns:
+            list: Les (ligne, erreurs) refusées si un lot a été envoyé, sinon une liste vide.
+        """
+        size = len(json.dumps(row, ensure_ascii=False, default=str).encode("utf-8"))
+        failed = []
+        if self._rows and self._bytes + size > self.max_bytes:
+            failed = self.flush()
+
+        self._rows.append(row)
+        self._bytes += size
+
+        if len(self._rows) >= self.max_rows:
+            failed = failed + self.flush()
+        return failed
+
+    def flush(self):
+        """
+        Envoie le lot courant à BigQuery.
+
+        Returns:
+            list: Les (ligne, erreurs) refusées par BigQuery pour ce lot.
+        """
+        if not self._rows:
+            return []
+
+        rows, self._rows, self._bytes = self._rows, [], 0
+        try:
+            # L'id déterministe sert d'insertId : BigQuery ignore les lignes renvoyées deux fois
+            errors = self.client.insert_rows_json(
+                self.table, rows, row_ids=[row.get("id") for row in rows]
+            )  # Requête API
+        except Exception as e:
+            # Échec de la requête entière : toutes les lignes du lot sont en erreur
+            errors = [
+                {"index": index, "errors": [{"message": str(e)}]}
+                for index in range(len(rows))
+            ]
+        self.requests += 1
+
+        failed = [(rows[error["index"]], error["errors"]) for error in errors]
+        for row, row_errors in failed:
+            print(f"Ligne refusée par BigQuery ({row.get('source')}) : {row_errors}")
+
+        self.errors.extend(failed)
+        failed_indexes = {error["index"] for error in errors}
+        self._succeeded(
+            [row for index, row in enumerate(rows) if index not in failed_indexes]
+        )
+        return failed
+
+
+class NdjsonFileWriter(EventWriter):
+    """
+    Cette classe écrit les événements dans un fichier JSON délimité par des sauts de ligne (une ligne par événement).
+    Elle sert de fichier de préparation pour BigQueryLoadWriter et de remplaçant local de BigQuery pour les tests.
+
+    Args:
+        path (str): Chemin du fichier à écrire (écrasé s'il existe).
+        on_success (callable): Voir EventWriter.
+    """
+
+    def __init__(self, path, on_success=None):
+        super().__init__(on_success)
+        self.path = path
+        self._file = open(path, "w", encoding="utf-8")
+        self.staged = 0
+
+    def _write(self, row):
+        self._file.write(json.dumps(row, ensure_ascii=False, default=str))
+        self._file.write("\n")
+        self.staged += 1
+
+    def insert(self, row):
+        self._write(row)
+        self._succeeded([row])
+        return []
+
+    def flush(self):
+        if not self._file.closed:
+            self._file.flush()
+        return []
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+        return []
+
+
+class BigQueryLoadWriter(NdjsonFileWriter):
+    """
+    Cette classe prépare les événements dans un fichier NDJSON local puis les charge dans BigQuery
+    avec un seul job de chargement à la fermeture. Contrairement à insert_rows_json, un job de chargement
+    n'est pas facturé et convient aux rechargements complets de la table.
+
+    Args:
+        dataset_id (str): Le dataset BigQuery.
+        table_id (str): La table BigQuery.
+        client (bigquery.Client): Client à réutiliser, créé si None.
+        staging_path (str): Fichier de préparation, un fichier temporaire si None.
+        write_disposition (str): bigquery.WriteDisposition.WRITE_APPEND (par défaut) ou WRITE_TRUNCATE pour un rechargement complet.
+        on_success (callable): Voir EventWriter. Appelée par lots de 1000 lignes une fois le job terminé.
+    """
+
+    def __init__(
+        self,
+        dataset_id="festa",
+        table_id="evenement",
+        client=None,
+        staging_path=None,
+        write_disposition=bigquery.WriteDisposition.WRITE_APPEND,
+        on_success=None,
+    ):
+        if staging_path is None:
+            handle, staging_path = tempfile.mkstemp(prefix=f"{table_id}-", suffix=".ndjson")
+            os.close(handle)
+        super().__init__(staging_path, on_success)
+        self.client = client if client is not None else bigquery.Client()
+        self.table = self.client.get_table(self.client.dataset(dataset_id).table(table_id))
+        self.write_disposition = write_disposition
+        self._loaded = False
+
+    def insert(self, row):
+        # Les lignes ne sont comptées comme écrites qu'après le job de chargement
+        self._write(row)
+        return []
+
+    def abort(self):
+        # Un chargement partiel (surtout en WRITE_TRUNCATE) remplacerait la table : le fichier est supprimé sans être chargé
+        super().close()
+        if not self._loaded:
+            self._loaded = True
+            os.remove(self.path)
+            print(f"Chargement annulé : {self.staged} lignes préparées n'ont pas été chargées.")
+        return []
+
+    def close(self):
+        super().close()
+        if self._loaded:
+            return []
+        self._loaded = True
+
+        if self.staged == 0:
+            os.remove(self.path)
+            return []
+
+        job_config = bigquery.LoadJobConfig(
+            source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+            schema=self.table.schema,
+            write_disposition=self.write_disposition,
+        )
+        try:
+            with open(self.path, "rb") as source:
+                job = self.client.load_table_from_file(
+                    source, self.table, job_config=job_config
+                )  # Requête API
+            self.requests += 1
+            job.result()
+            self._replay_staged()
+        except Exception as e:
+            print(f"Le job de chargement a échoué : {e}")
+            self.errors.append((None, [{"message": str(e)}]))
+        finally:
+            os.remove(self.path)
+        return self.errors
+
+    def _replay_staged(self, batch_size=1000):
+        # Relit le fichier de préparation pour signaler les lignes chargées, sans tout garder en mémoire
+        with open(self.path, encoding="utf-8") as staged_file:
+            rows = []
+            for line in staged_file:
+                rows.append(json.loads(line))
+                if len(rows) >= batch_size:
+                    self._succeeded(rows)
+                    rows = []
+            self._succeeded(rows)
+
+
+# ===================================================================================================
+#                                          MERGE_WRITER
+# ===================================================================================================
+
+
+def load_rows_to_table(client, rows, table, schema):
+    """
+    Cette fonction remplace le contenu d'une table (de travail) par les lignes données, avec un job de chargement.
+
+    Args:
+        client (bigquery.Client): Le client BigQuery.
+        rows (list): Les lignes à charger.
+        table (str): L'identifiant complet de la table, par exemple "festa.evenement_maj".
+        schema (list): Le schéma (liste de SchemaField) de la table.
+    """
+    payload = "".join(
+        json.dumps(row, ensure_ascii=False, default=str) + "\n" for row in rows
+    )
+    job_config = bigquery.LoadJobConfig(
+        source_format=bigquery.SourceFormat.NEWLINE_DELIMITED_JSON,
+        schema=schema,
+        write_disposition=bigquery.WriteDisposition.WRITE_TRUNCATE,
+    )
+    job = client.load_table_from_file(
+        io.BytesIO(payload.encode("utf-8")), table, job_config=job_config
+    )  # Requête API
+    job.result()
+
+
+class MergeWriter(EventWriter):
+    """
+    Cette classe réécrit des événements déjà présents dans la table : les lignes sont chargées par lots dans une
+    table de travail, puis appliquées avec une seule requête MERGE par lot (jointure sur la colonne source).
+    Les colonnes id, source, score et ts_entree des lignes existantes sont conservées.
+
+    Args:
+        dataset_id (str): Le dataset BigQuery.
+        table_id (str): La table BigQuery à mettre à jour.
+        staging_table_id (str): La table de travail, écrasée à chaque lot.
+        client (bigquery.Client): Client à réutiliser, créé si None.
+        max_rows (int): Nombre maximal de lignes par MERGE.
+        on_success (callable): Voir EventWriter.
+    """
+
+    # Colonnes jamais modifiées par le MERGE
+    KEPT_FIELDS = {"id", "source", "score", "ts_entree"}
+
+    def __init__(
+        self,
+        dataset_id="festa",
+        table_id="evenement",
+        staging_table_id="evenement_maj",
+        client=None,
+        max_rows=5000,
+        on_success=None,
+    ):
+        super().__init__(on_success)
+        self.client = client if client is not None else bigquery.Client()
+        self.table = self.client.get_table(self.client.dataset(dataset_id).table(table_id))
+        if not any(field.name == "empreinte" for field in self.table.schema):
+            raise ValueError(
+                f"La table {dataset_id}.{table_id} n'a pas de colonne empreinte : "
+                f"ALTER TABLE `{dataset_id}.{table_id}` ADD COLUMN empreinte STRING"
+            )
+        self.target = f"{dataset_id}.{table_id}"
+        self.staging = f"{dataset_id}.{staging_table_id}"
+        self.max_rows = max_rows
+        self._rows = []
+
+    def insert(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.max_rows:
+            return self.flush()
+        return []
+
+    def flush(self):
+        if not self._rows:
+            return []
+
+        # MERGE refuse plusieurs lignes sources pour une même ligne cible : seule la dernière version
+        # de chaque source est gardée
+        rows = list({row.get("source"): row for row in self._rows}.values())
+        self._rows = []
+        columns = [
+            field.name for field in self.table.schema if field.name not in self.KEPT_FIELDS
+        ]
+        merge_query = f"""
+            MERGE `{self.target}` T
+            USING `{self.staging}` S
+            ON T.source = S.source
+            WHEN MATCHED THEN UPDATE SET {", ".join(f"{column} = S.{column}" for column in columns)}
+        """
+        try:
+            load_rows_to_table(self.client, rows, self.staging, self.table.schema)
+            self.client.query(merge_query).result()  # Requête API
+            self.requests += 1
+        except Exception as e:
+            print(f"Le MERGE des événements modifiés a échoué : {e}")
+            failed = [(row, [{"message": str(e)}]) for row in rows]
+            self.errors.extend(failed)
+            return failed
+
+        self._succeeded(rows)
+        return []
+
+
+# ===================================================================================================
+#                                        DATE_INDEX
+# ===================================================================================================
+
+
+class DateIntervalIndex:
+    """
+    Index local des périodes (date_debut, date_fin) des événements de la table, pour les recherches par période.
+    Il est construit à partir de la table et réconcilié régulièrement (voir load_date_index) ; l'ingestion ne
+    le tient pas à jour, delete_expired_events en retire les événements expirés.
+
+    Les événements sont gardés dans deux tableaux triés, l'un par date de début, l'autre par date de fin :
+    les événements expirés forment un préfixe du second, et une recherche par période ne lit que le plus court
+    des deux candidats (début avant la fin de la période, ou fin après son début).
+    Les dates sont des jours depuis 1970 ; UNKNOWN marque une date absente.
+    """
+
+    UNKNOWN = np.iinfo(np.int64).min
+
+    def __init__(self):
+        # {id: (date_debut, date_fin, jour d'entrée)}
+        self._events = {}
+        self._sorted = None
+
+    def __len__(self):
+        return len(self._events)
+
+    def __contains__(self, event_id):
+        return event_id in self._events
+
+    def add(self, event_id, date_debut, date_fin, ts_entree=None):
+        days = [_epoch_day(value) for value in (date_debut, date_fin, ts_entree)]
+        self._events[event_id] = tuple(self.UNKNOWN if day is None else day for day in days)
+        self._sorted = None
+
+    def record(self, rows):
+        # Même signature que DedupeIndex.record : utilisable comme on_success d'un EventWriter
+        for row in rows:
+            self.add(row.get("id"), row.get("date_debut"), row.get("date_fin"), row.get("ts_entree"))
+
+    def discard(self, event_ids):
+        for event_id in event_ids:
+            self._events.pop(event_id, None)
+        self._sorted = None
+
+    def _arrays(self):
+        # Tableaux triés, reconstruits seulement après une modification
+        if self._sorted is None:
+            ids = np.array(list(self._events), dtype=str)
+            days = np.array(list(self._events.values()), dtype=np.int64).reshape(-1, 3)
+            by_start = np.argsort(days[:, 0], kind="stable")
+            by_end = np.argsort(days[:, 1], kind="stable")
+            self._sorted = {
+                "ids": ids,
+                "days": days,
+                "by_start": by_start,
+                "starts": days[by_start, 0],
+                "by_end": by_end,
+                "ends": days[by_end, 1],
+            }
+        return self._sorted
+
+    def expired(self, today=None):
+        """
+        Renvoie les événements expirés : terminés avant today et entrés dans la table avant today
+        (mêmes conditions que la suppression d'origine). Le coût dépend du nombre d'événements expirés.
+
+        Args:
+            today (str | date): Date du jour, aujourd'hui si None.
+
+        Returns:
+            list: Identifiants des événements expirés.
+        """
+        today = _epoch_day(today or datetime.now().date())
+        arrays = self._arrays()
+        first = np.searchsorted(arrays["ends"], self.UNKNOWN, side="right")
+        last = np.searchsorted(arrays["ends"], today, side="left")
+        candidates = arrays["by_end"][first:last]
+        entries = arrays["days"][candidates, 2]
+        candidates = candidates[(entries != self.UNKNOWN) & (entries < today)]
+        return arrays["ids"][candidates].tolist()
+
+    def between(self, start, end):
+        """
+        Renvoie les événements en cours pendant au moins un jour de la période [start, end].
+
+        Args:
+            start, end (str | date): Début et fin (incluse) de la période.
+
+        Returns:
+            list: Identifiants des événements, par date de début croissante.
+        """
+        start, end = _epoch_day(start), _epoch_day(end)
+        arrays = self._arrays()
+        # Candidats : commencés avant la fin de la période, ou terminés après son début (le plus court des deux)
+        first_start = np.searchsorted(arrays["starts"], self.UNKNOWN, side="right")
+        last_start = np.searchsorted(arrays["starts"], end, side="right")
+        first_end = np.searchsorted(arrays["ends"], start, side="left")
+        if last_start - first_start <= len(arrays["ends"]) - first_end:
+            candidates = arrays["by_start"][first_start:last_start]
+            candidates = candidates[arrays["days"][candidates, 1] >= start]
+        else:
+            candidates = arrays["by_end"][first_end:]
+            starts = arrays["days"][candidates, 0]
+            candidates = candidates[(starts != self.UNKNOWN) & (starts <= end)]
+            candidates = candidates[np.argsort(arrays["days"][candidates, 0], kind="stable")]
+        return arrays["ids"][candidates].tolist()
+
+    def save(self, path):
+        arrays = self._arrays()
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, ids=arrays["ids"], days=arrays["days"])
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        index = cls()
+        with np.load(path) as data:
+            index._events = dict(zip(data["ids"].tolist(), map(tuple, data["days"].tolist())))
+        return index
+
+
+def reconcile_date_index(path=None, shard_index=0, shard_count=1):
+    """
+    Cette fonction reconstruit l'index des dates à partir de la table BigQuery et le sauvegarde.
+
+    Args:
+        path (str): Chemin du fichier d'index, DATE_INDEX_PATH (propre à la partition) si None
+            (l'index n'est pas sauvegardé si aucun emplacement n'est configuré).
+        shard_index (int): Indice de la partition : seuls ses événements sont gardés (voir shard_of).
+        shard_count (int): Nombre de partitions.
+
+    Returns:
+        DateIntervalIndex: L'index reconstruit.
+    """
+    path = path or shard_path(DATE_INDEX_PATH, shard_index, shard_count)
+    client = bigquery.Client()
+    query = "SELECT id, source, date_debut, date_fin, DATE(ts_entree) AS ts_entree FROM `festa.evenement`"
+
+    index = DateIntervalIndex()
+    index.record(
+        row
+        for row in client.query(query).result()
+        if shard_of(row.get("source"), shard_count) == shard_index
+    )
+    if path:
+        index.save(path)
+    print(f"Index des dates reconstruit : {len(index)} événements.")
+    return index
+
+
+def load_date_index(path=None, max_age_days=None, shard_index=0, shard_count=1):
+    """
+    Cette fonction charge l'index des dates depuis son fichier, en le réconciliant d'abord avec la table BigQuery
+    s'il n'existe pas encore ou date de plus de max_age_days jours (comme load_dedupe_index).
+
+    Args:
+        path (str): Chemin du fichier d'index, DATE_INDEX_PATH (propre à la partition) si None.
+        max_age_days (float): Âge maximal du fichier avant réconciliation, DEDUPE_RECONCILE_DAYS si None.
+        shard_index (int): Indice de la partition ; par défaut, chaque partition a son propre fichier (voir shard_path).
+        shard_count (int): Nombre de partitions.
+
+    Returns:
+        DateIntervalIndex: L'index des dates.
+    """
+    path = path or shard_path(DATE_INDEX_PATH, shard_index, shard_count)
+    max_age_days = DEDUPE_RECONCILE_DAYS if max_age_days is None else max_age_days
+
+    if (
+        not path
+        or not os.path.exists(path)
+        or time.time() - os.path.getmtime(path) > max_age_days * 86400
+    ):
+        return reconcile_date_index(path, shard_index, shard_count)
+    return DateIntervalIndex.load(path)
+
+
+# ===================================================================================================
+#                                       DELETE_EXPIRED_EVENTS
+# ===================================================================================================
+
+
+def delete_expired_events(date_index_paths=None):
+    """
+    Cette fonction supprime tous les événements de la table BigQuery terminés avant la date actuelle.
+
+    La requête DELETE ne porte que sur les dates de la table : elle supprime aussi les lignes écrites par les
+    autres instances et partitions. Elle ne lit que les partitions expirées si la table est partitionnée
+    par date_fin (PARTITION BY date_fin, à la création de la table) ; sinon elle parcourt toute la table,
+    ce qui est signalé à chaque exécution.
+
+    Args:
+        date_index_paths (list): Fichiers d'index des dates (voir reconcile_date_index) dont les événements expirés
+            sont retirés après la suppression, ceux qui n'existent pas étant ignorés. [DATE_INDEX_PATH] si None.
+
+    Returns:
+        int: Nombre d'événements supprimés.
+    """
+
+    # Utiliser les informations d'identification par défaut
+    client = bigquery.Client()
+
+    # Spécifiez votre dataset et table BigQuery
+    dataset_id = "festa"
+    table_id = "evenement"
+
+    # Obtenir la date actuelle
+    date_actuelle = datetime.now().date()
+
+    partitioning = client.get_table(f"{dataset_id}.{table_id}").time_partitioning
+    if partitioning is None or partitioning.field != "date_fin":
+        print(
+            f"La table {dataset_id}.{table_id} n'est pas partitionnée par date_fin : "
+            "la suppression des événements expirés parcourt toute la table."
+        )
+
+    # Construction de la requête de suppression
+    query_delete = f"""
+        DELETE FROM `{dataset_id}.{table_id}`
+        WHERE date_fin < @date_actuelle AND DATE(ts_entree) < @date_actuelle
+    """
+    job_config = bigquery.QueryJobConfig(
+        query_parameters=[
+            bigquery.ScalarQueryParameter("date_actuelle", "DATE", date_actuelle),
+        ]
+    )
+
+    # Exécution de la requête de suppression
+    query_job = client.query(query_delete, job_config=job_config)  # API request
+    query_job.result()
+    deleted = query_job.num_dml_affected_rows or 0
+
+    # Les index des dates oublient les événements expirés, sans parcourir la table
+    for path in [DATE_INDEX_PATH] if date_index_paths is None else date_index_paths:
+        if path and os.path.exists(path):
+            date_index = DateIntervalIndex.load(path)
+            date_index.discard(date_index.expired(date_actuelle))
+            date_index.save(path)
+
+    print(f"{deleted} événements supprimés.")
+    print(
+        "Les événements avec une date de fin inférieure à la date actuelle ont été supprimés."
+    )
+    return deleted
+
+
+# ===================================================================================================
+#                                          WHITELIST
+# ===================================================================================================
+def whitelist(event_title, list_words):
+    """
+    Cette fonction vérifie si l'événement doit être retenu en fonction du titre.
+    Chaque élément dans list_words est considéré en entier.
+
+    Args:
+        event_title (str): Le titre de l'événement.
+        list_words (list): Une liste de mots ou groupes de mots à vérifier.
+
+    Returns:
+        bool: True si l'événement doit être retenu, False sinon.
+    """
+    lower_event_title = event_title.lower()
+    title_words = lower_event_title.split()
+
+    for word_group in list_words:
+        words = word_group.lower().split()
+        for i in range(len(title_words) - len(words) + 1):
+            if title_words[i : i + len(words)] == words:
+                return True
+    return False
+
+
+# ===================================================================================================
+#                                          BLACKLIST
+# ===================================================================================================
+def blacklist(event_title, list):
+    """
+    Cette fonction vérifie si l'événement doit être ignoré en fonction du titre.
+    Args:
+        event_title (str): Le titre de l'événement.
+        list (list): Une liste de mots interdits.
+
+    Returns:
+        bool: True si l'événement doit être ignoré, False sinon.
+    """
+    event_title_words = event_title.lower().split()
+    for word in event_title_words:
+        if word in list:
+            return True
+    return False
+
+
+# ===================================================================================================
+#                                          GET_CATEGORIE
+# ===================================================================================================
+def get_categorie(title):
+    """
+    Cette fonction répère le mot essentiel dans un titre.
+
+    Args:
+        title (str): Le titre à analyser.
+
+    Returns:
+        str: Le mot essentiel trouvé dans le titre, sinon "Autre".
+    """
+
+    # Convertir le titre en minuscules
+    lower_title = title.lower()
+
+    # Parcourir chaque phrase dans essentialWords
+    for phrase in essentialWords:
+        # Vérifier si la phrase est dans le titre
+        if phrase in lower_title:
+            return phrase
+
+    # Si aucune phrase essentielle n'a été trouvée, retourner "Autre"
+    return "autre"
+
+
+# ===================================================================================================
+#                                        NORMALIZE_TEXT
+# ===================================================================================================
+
+# Apostrophes et tirets remplacés par des espaces : "l'été" -> "l ete", "fest-noz" -> "fest noz"
+_FOLDED_CHARS = str.maketrans({char: " " for char in "'’ʼ`-‐‑–—"})
+
+
+def normalize_text(text):
+    """
+    Cette fonction normalise un texte pour la comparaison de mots clés : accents retirés (NFKD), minuscules,
+    apostrophes et tirets remplacés par des espaces, un seul espace entre les mots.
+
+    Args:
+        text (str): Le texte à normaliser (None accepté).
+
+    Returns:
+        str: Le texte normalisé, par exemple "Fête de l'Été" -> "fete de l ete".
+    """
+    if not text:
+        return ""
+    text = unicodedata.normalize("NFKD", text)
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    return " ".join(text.lower().translate(_FOLDED_CHARS).split())
+
+
+# ===================================================================================================
+#                                        KEYWORD_MATCHER
+# ===================================================================================================
+
+
+class KeywordMatcher:
+    """
+    Cette classe regroupe whitelist, blacklist et get_categorie dans un seul automate d'Aho-Corasick,
+    construit une fois à l'import. Un titre est parcouru une seule fois, caractère par caractère,
+    quel que soit le nombre de mots dans les listes.
+
+    Les listes sont compilées sous leur forme normalisée (normalize_text), sans doublons, et le titre
+    doit être normalisé une seule fois par l'appelant. Les mots des listes blanche et noire sont entourés
+    d'espaces pour ne correspondre qu'à des mots entiers, les mots essentiels sont cherchés comme sous-chaînes
+    (comme get_categorie).
+
+    Args:
+        white_words (list): Mots ou groupes de mots autorisés.
+        black_words (list): Mots ou groupes de mots interdits.
+        categories (list): Mots essentiels, par ordre de priorité. La catégorie renvoyée est le mot d'origine.
+    """
+
+    def __init__(self, white_words, black_words, categories):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+
+        for phrase in dict.fromkeys(map(normalize_text, white_words)):
+            self._add(" " + phrase + " ", ("white", 0))
+        for phrase in dict.fromkeys(map(normalize_text, black_words)):
+            self._add(" " + phrase + " ", ("black", 0))
+        for priority, phrase in enumerate(categories):
+            self._add(normalize_text(phrase), ("categorie", priority))
+
+        self._categories = list(categories)
+        self._build()
+
+    def _add(self, pattern, output):
+        state = 0
+        for char in pattern:
+            if char not in self._goto[state]:
+                self._goto.append({})
+                self._fail.append(0)
+                self._out.append([])
+                self._goto[state][char] = len(self._goto) - 1
+            state = self._goto[state][char]
+        self._out[state].append(output)
+
+    def _build(self):
+        # Calcul des liens d'échec en largeur d'abord
+        queue = list(self._goto[0].values())
+        for state in queue:
+            for char, child in self._goto[state].items():
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0) if state else 0
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+
+    def match(self, normalized_title):
+        """
+        Analyse un titre en un seul passage.
+
+        Args:
+            normalized_title (str): Le titre de l'événement, déjà passé par normalize_text.
+
+        Returns:
+            tuple: (autorisé par la liste blanche, interdit par la liste noire, catégorie ou "autre").
+        """
+        text = " " + normalized_title + " "
+
+        goto, fail, out = self._goto, self._fail, self._out
+        autorise = interdit = False
+        priority = len(self._categories)
+
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            for kind, value in out[state]:
+                if kind == "white":
+                    autorise = True
+                elif kind == "black":
+                    interdit = True
+                elif value < priority:
+                    priority = value
+
+        categorie = self._categories[priority] if priority < len(self._categories) else "autre"
+        return autorise, interdit, categorie
+
+
+keyword_matcher = KeywordMatcher(whiteList, blackList, essentialWords)
+
+
+# ===================================================================================================
+#                                          TEST DE SIMILARITE
+# ===================================================================================================
+
+
+def jaccard_similarity(list1, list2):
+    """
+    Cette fonction calcule la similarité de Jaccard entre deux listes.
+
+    Args:
+        list1 (list): Première liste à comparer.
+        list2 (list): Deuxième liste à comparer.
+
+    Returns:
+        float: Score de similarité de Jaccard entre les deux listes.
+    """
+    s1 = set(list1)
+    s2 = set(list2)
+    return len(s1.intersection(s2)) / len(s1.union(s2))
 
 
 def calculate_event_similarity(event1, event2):
     """
-    Cette fonction calcule un score de similarité global entre deux événements en utilisant la similarité de Jaccard
-    et d'autres critères (comparaison des titres, des villes, des dates de début et de fin).
+    Cette fonction calcule un score de similarité global entre deux événements en utilisant la similarité de Jaccard
+    et d'autres critères (comparaison des titres, des villes, des dates de début et de fin).
+
+    Args:
+        event1 (dict): Premier événement à comparer.
+        event2 (dict): Deuxième événement à comparer.
+
+    Returns:
+        float: Score de similarité entre les deux événements.
+    """
+    final_similarity = event_similarity(event1, event2)
+    print(
+        f"Le score de similarité entre les deux événements est de : {final_similarity*100:.2f}%"
+    )
+    return final_similarity
+
+
+def event_similarity(event1, event2):
+    """
+    Même score que calculate_event_similarity, sans affichage : à utiliser sur de nombreuses paires.
+
+    Args:
+        event1 (dict): Premier événement à comparer.
+        event2 (dict): Deuxième événement à comparer.
+
+    Returns:
+        float: Score de similarité entre les deux événements.
+    """
+
+    # Comparaison des titres
+    title_similarity = jaccard_similarity(
+        event1["titre"].split(), event2["titre"].split()
+    )
+
+    # Comparaison des villes
+    city_similarity = 1 if event1["ville"].lower() == event2["ville"].lower() else 0
+
+    # Comparaison des dates de début et de fin
+    start_date_diff = abs(
+        (parse_date(event1["date_debut"]) - parse_date(event2["date_debut"])).days
+    )
+    end_date_diff = abs(
+        (parse_date(event1["date_fin"]) - parse_date(event2["date_fin"])).days
+    )
+
+    # Normalisation des différences de dates (supposons qu'une différence de 30 jours est considérée comme une différence maximale)
+    start_date_similarity = 1 - (start_date_diff / 30)
+    end_date_similarity = 1 - (end_date_diff / 30)
+
+    # Calcul du score de similarité final comme la moyenne des scores de similarité individuels
+    final_similarity = np.mean(
+        [title_similarity, city_similarity, start_date_similarity, end_date_similarity]
+    )
+    return final_similarity
+
+
+# ===================================================================================================
+#                                        SCORE_EVENT_PAIRS
+# ===================================================================================================
+
+# Jour 0 des dates converties en entiers (1970-01-01)
+EPOCH_ORDINAL = datetime(1970, 1, 1).toordinal()
+
+
+def event_arrays(events):
+    """
+    Cette fonction prépare des événements adaptés pour score_event_pairs : les titres deviennent des ensembles
+    d'identifiants de mots (format CSR), les villes des identifiants, et les dates des nombres de jours depuis 1970.
+    Chaque titre, ville et date n'est ainsi lu qu'une fois, quel que soit le nombre de paires.
+
+    Args:
+        events (list): Événements adaptés ("titre", "ville", "date_debut", "date_fin").
+
+    Returns:
+        dict: Tableaux NumPy "indptr" et "tokens" (les mots du titre i sont tokens[indptr[i]:indptr[i + 1]]),
+            "villes", "start_days", "end_days" et "valid" (False si la ville ou une date manque).
+    """
+    vocabulary = {}
+    villes = {}
+    tokens = []
+    indptr = np.zeros(len(events) + 1, dtype=np.int64)
+    ville_ids = np.full(len(events), -1, dtype=np.int64)
+    start_days = np.zeros(len(events), dtype=np.int64)
+    end_days = np.zeros(len(events), dtype=np.int64)
+    valid = np.zeros(len(events), dtype=bool)
+
+    for i, event in enumerate(events):
+        # Mêmes mots que calculate_event_similarity : titre.split(), sans normalisation
+        tokens.extend(
+            sorted(vocabulary.setdefault(word, len(vocabulary)) for word in set((event.get("titre") or "").split()))
+        )
+        indptr[i + 1] = len(tokens)
+        try:
+            ville_ids[i] = villes.setdefault(event["ville"].lower(), len(villes))
+            start_days[i] = parse_date(event["date_debut"]).toordinal() - EPOCH_ORDINAL
+            end_days[i] = parse_date(event["date_fin"]).toordinal() - EPOCH_ORDINAL
+        except (AttributeError, KeyError):
+            continue
+        valid[i] = True
+
+    return {
+        "indptr": indptr,
+        "tokens": np.asarray(tokens, dtype=np.int64),
+        "villes": ville_ids,
+        "start_days": start_days,
+        "end_days": end_days,
+        "valid": valid,
+    }
+
+
+def _pair_jaccard(indptr, tokens, first, second):
+    # Jaccard des titres pour chaque paire : les mots des deux titres sont rassemblés avec le numéro de la paire,
+    # triés, et les mots présents deux fois dans une même paire forment l'intersection
+    len_first = indptr[first + 1] - indptr[first]
+    len_second = indptr[second + 1] - indptr[second]
+    lengths = np.stack((len_first, len_second), axis=1).ravel()
+    owners = np.stack((first, second), axis=1).ravel()
+    pair_of = np.repeat(np.arange(len(first), dtype=np.int64), len_first + len_second)
+    # Position de chaque mot dans tokens : début du titre + rang dans le titre
+    group_starts = np.cumsum(lengths) - lengths
+    ranks = np.arange(lengths.sum(), dtype=np.int64) - np.repeat(group_starts, lengths)
+    words = tokens[np.repeat(indptr[owners], lengths) + ranks]
+
+    vocabulary_size = int(tokens.max(initial=0)) + 1
+    keys = pair_of * vocabulary_size + words
+    keys.sort()
+    shared = keys[1:][keys[1:] == keys[:-1]]
+    intersection = np.bincount(shared // vocabulary_size, minlength=len(first))
+
+    union = len_first + len_second - intersection
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(union > 0, intersection / union, 0.0)
+
+
+def score_event_pairs(arrays, pairs, chunk_size=1_000_000):
+    """
+    Cette fonction calcule le score de calculate_event_similarity pour de nombreuses paires à la fois :
+    moyenne de la similarité de Jaccard des titres, de l'égalité des villes et des similarités des dates
+    de début et de fin (1 - écart en jours / 30).
 
     Args:
-        event1 (dict): Premier événement à comparer.
-        event2 (dict): Deuxième événement à comparer.
+        arrays (dict): Événements préparés par event_arrays.
+        pairs (np.ndarray): Tableau (n, 2) d'indices d'événements.
+        chunk_size (int): Nombre de paires traitées à la fois, pour borner la mémoire.
 
     Returns:
-        float: Score de similarité entre les deux événements.
+        np.ndarray: Les n scores (NaN si la ville ou une date d'un des deux événements manque).
     """
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    scores = np.empty(len(pairs), dtype=np.float64)
+    for start in range(0, len(pairs), chunk_size):
+        first = pairs[start : start + chunk_size, 0]
+        second = pairs[start : start + chunk_size, 1]
 
-    # Comparaison des titres
-    title_similarity = jaccard_similarity(
-        event1["titre"].split(), event2["titre"].split()
-    )
+        title_similarity = _pair_jaccard(arrays["indptr"], arrays["tokens"], first, second)
+        city_similarity = arrays["villes"][first] == arrays["villes"][second]
+        start_date_similarity = 1 - np.abs(arrays["start_days"][first] - arrays["start_days"][second]) / 30
+        end_date_similarity = 1 - np.abs(arrays["end_days"][first] - arrays["end_days"][second]) / 30
 
-    # Comparaison des villes
-    city_similarity = 1 if event1["ville"].lower() == event2["ville"].lower() else 0
+        chunk = (title_similarity + city_similarity + start_date_similarity + end_date_similarity) / 4
+        valid = arrays["valid"][first] & arrays["valid"][second]
+        scores[start : start + len(first)] = np.where(valid, chunk, np.nan)
+    return scores
 
-    # Comparaison des dates de début et de fin
-    date_format = "%Y-%m-%d"
-    start_date_diff = abs(
-        (
-            datetime.strptime(event1["date_debut"], date_format)
-            - datetime.strptime(event2["date_debut"], date_format)
-        ).days
-    )
-    end_date_diff = abs(
-        (
-            datetime.strptime(event1["date_fin"], date_format)
-            - datetime.strptime(event2["date_fin"], date_format)
-        ).days
-    )
 
-    # Normalisation des différences de dates (supposons qu'une différence de 30 jours est considérée comme une différence maximale)
-    start_date_similarity = 1 - (start_date_diff / 30)
-    end_date_similarity = 1 - (end_date_diff / 30)
+# ===================================================================================================
+#                                        NEAR_DUPLICATES
+# ===================================================================================================
 
-    # Calcul du score de similarité final comme la moyenne des scores de similarité individuels
-    final_similarity = np.mean(
-        [title_similarity, city_similarity, start_date_similarity, end_date_similarity]
-    )
-    print(
-        f"Le score de similarité entre les deux événements est de : {final_similarity*100:.2f}%"
-    )
-    return final_similarity
+
+class NearDuplicateFinder:
+    """
+    Recherche des quasi-doublons parmi de nombreux événements adaptés (DATAtourisme, OpenAgenda...),
+    sans comparer toutes les paires :
+
+    1. les événements sont regroupés par (ville normalisée, semaine ISO de date_debut) ; chacun est aussi
+       placé dans les `spill_weeks` semaines suivantes, pour que deux dates de début séparées d'au plus
+       `max_start_gap` jours se rencontrent ;
+    2. dans chaque groupe, un MinHash des mots du titre est découpé en `bands` bandes : deux événements
+       deviennent candidats s'ils partagent une bande (LSH) ;
+    3. les candidats sont notés d'un coup avec score_event_pairs et gardés au-dessus de `threshold`.
+
+    Le score est la moyenne de quatre termes : titre, ville (0 ou 1) et 1 - écart / 30 pour chaque date.
+    Au-dessus de `threshold`, il faut donc écart de début + écart de fin <= 120 * (1 - threshold) jours
+    (24 jours pour 0,8), ce qui fixe `max_start_gap`. Le regroupement par ville suppose threshold > 0,75 :
+    en dessous, des paires de villes différentes peuvent atteindre le seuil et ne sont pas trouvées.
+
+    Avec `bands` bandes de `num_perm / bands` lignes, deux titres de similarité de Jaccard J deviennent
+    candidats avec une probabilité 1 - (1 - J^r)^b. Avec threshold = 0,8, un titre de similarité 0,2 peut
+    suffire : le réglage par défaut (une ligne par bande) le retient avec une probabilité supérieure à 0,999.
+
+    Args:
+        threshold (float): Score minimal (score_event_pairs) d'un quasi-doublon.
+        num_perm (int): Nombre de permutations du MinHash.
+        bands (int): Nombre de bandes LSH (doit diviser num_perm).
+        seed (int): Graine des permutations, pour des résultats reproductibles.
+    """
+
+    # Plus grand nombre premier inférieur à 2^32 : a * x + b tient dans un uint64
+    PRIME = np.uint64(4294967291)
+
+    def __init__(self, threshold=0.8, num_perm=32, bands=32, seed=1):
+        if num_perm % bands:
+            raise ValueError("bands doit diviser num_perm.")
+        self.threshold = threshold
+        # Marge pour l'arrondi flottant : un écart pile à la limite reste comparé
+        self.max_start_gap = max(0, int(120 * (1 - threshold) + 1e-9))
+        # Deux dates séparées de g jours tombent au plus à (g + 6) // 7 semaines d'écart
+        self.spill_weeks = (self.max_start_gap + 6) // 7
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, int(self.PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._b = rng.integers(0, int(self.PRIME), num_perm, dtype=np.uint64)[:, None]
+        self._band_weights = rng.integers(1, 1 << 62, self.rows, dtype=np.uint64) | np.uint64(1)
+
+    @staticmethod
+    def tokens(title):
+        return set(normalize_text(title).split())
+
+    @staticmethod
+    def block_key(event, villes=None):
+        # (ville normalisée, lundi de la semaine de date_debut), ou None si l'événement ne peut pas être comparé
+        # villes : cache {ville: ville normalisée} partagé entre les appels
+        ville = event.get("ville")
+        if not ville or not event.get("date_debut") or not event.get("date_fin"):
+            return None
+        if villes is None or ville not in villes:
+            normalized = normalize_text(ville)
+            if villes is None:
+                ville = normalized
+            else:
+                ville = villes[ville] = normalized
+        else:
+            ville = villes[ville]
+        parsed = parse_date(event["date_debut"])
+        if parsed is None:
+            return None
+        day = parsed.toordinal()
+        # Les ordinaux commencent un lundi (1er janvier de l'an 1) : (day - 1) // 7 numérote les semaines
+        return ville, day - (day - 1) % 7
+
+    def signatures(self, token_sets, chunk_size=20000):
+        """
+        Calcule les signatures MinHash, par lots de chunk_size ensembles pour borner la mémoire.
+
+        Args:
+            token_sets (list): Ensembles de mots, tous non vides.
+
+        Returns:
+            np.ndarray: Tableau (len(token_sets), num_perm) de uint64.
+        """
+        signatures = np.empty((len(token_sets), self.num_perm), dtype=np.uint64)
+        for start in range(0, len(token_sets), chunk_size):
+            chunk = token_sets[start : start + chunk_size]
+            hashes = np.fromiter(
+                (zlib.crc32(token.encode("utf-8")) for tokens in chunk for token in tokens),
+                dtype=np.uint64,
+            )
+            offsets = np.cumsum([0] + [len(tokens) for tokens in chunk[:-1]])
+            permuted = (self._a * hashes[None, :] + self._b) % self.PRIME
+            signatures[start : start + len(chunk)] = np.minimum.reduceat(
+                permuted, offsets, axis=1
+            ).T
+        return signatures
+
+    def candidate_pairs(self, events):
+        """
+        Renvoie les paires candidates (même ville, semaines de début séparées d'au plus spill_weeks
+        et au moins une bande MinHash commune).
+
+        Args:
+            events (list): Événements adaptés ("titre", "ville", "date_debut", "date_fin").
+
+        Returns:
+            np.ndarray: Tableau (n, 2) d'indices i < j dans events, sans doublon.
+        """
+        indices, blocks, token_sets = [], [], []
+        block_ids = {}
+        villes = {}
+        for i, event in enumerate(events):
+            key = self.block_key(event, villes)
+            if key is None:
+                continue
+            tokens = self.tokens(event.get("titre"))
+            if not tokens:
+                continue
+            ville, monday = key
+            # Semaine de l'événement et spill_weeks semaines suivantes
+            for week in range(self.spill_weeks + 1):
+                week_start = monday + 7 * week
+                blocks.append(block_ids.setdefault((ville, week_start), len(block_ids)))
+                indices.append(i)
+            token_sets.append(tokens)
+        if not token_sets:
+            return np.empty((0, 2), dtype=np.int64)
+
+        indices = np.asarray(indices, dtype=np.int64)
+        blocks = np.asarray(blocks, dtype=np.uint64)
+        # Chaque événement apparaît une fois par semaine couverte, avec la même signature
+        signatures = np.repeat(self.signatures(token_sets), self.spill_weeks + 1, axis=0)
+
+        pairs = []
+        for band in range(self.bands):
+            rows = signatures[:, band * self.rows : (band + 1) * self.rows]
+            band_hash = (rows * self._band_weights).sum(axis=1, dtype=np.uint64)
+            # Groupe = (bloc, hachage de la bande) : tri puis découpage aux changements de clé
+            order = np.lexsort((band_hash, blocks))
+            keys_block, keys_hash = blocks[order], band_hash[order]
+            starts = np.flatnonzero(
+                np.r_[True, (keys_block[1:] != keys_block[:-1]) | (keys_hash[1:] != keys_hash[:-1])]
+            )
+            sizes = np.diff(np.r_[starts, len(order)])
+            # Un événement n'apparaît qu'une fois par bloc : les membres d'un groupe sont distincts.
+            # Les groupes de deux, de loin les plus fréquents, sont traités d'un coup
+            pair_starts = starts[sizes == 2]
+            first, second = indices[order[pair_starts]], indices[order[pair_starts + 1]]
+            pairs.append(np.stack((np.minimum(first, second), np.maximum(first, second)), axis=1))
+            for start, size in zip(starts[sizes > 2], sizes[sizes > 2]):
+                members = np.sort(indices[order[start : start + size]])
+                i, j = np.triu_indices(size, k=1)
+                pairs.append(np.stack((members[i], members[j]), axis=1))
+
+        return np.unique(np.concatenate(pairs), axis=0)
+
+    def find(self, events):
+        """
+        Cette fonction recherche les quasi-doublons parmi les événements.
+
+        Args:
+            events (list): Événements adaptés.
+
+        Returns:
+            list: (i, j, score) pour chaque paire d'indices i < j dont le score atteint threshold,
+                du score le plus élevé au plus faible.
+        """
+        pairs = self.candidate_pairs(events)
+        scores = score_event_pairs(event_arrays(events), pairs)
+        kept = np.flatnonzero(scores >= self.threshold)
+        kept = kept[np.argsort(-scores[kept], kind="stable")]
+        return [(int(pairs[k, 0]), int(pairs[k, 1]), float(scores[k])) for k in kept]
 
 
 # ===================================================================================================
-# *                                    PROCESS_EVENT_DATA
+#                                        GEO_INDEX
 # ===================================================================================================
 
+# Rayon moyen de la Terre, en kilomètres
+EARTH_RADIUS_KM = 6371.0088
 
-def process_event_data(url):
+
+def _epoch_day(value):
+    # Date ("2024-07-14", "2024-07-14T20:00:00", date ou datetime) -> jours depuis 1970, None si absente ou invalide
+    if value is None:
+        return None
+    if isinstance(value, str):
+        value = parse_date(value)
+        if value is None:
+            return None
+    return value.toordinal() - EPOCH_ORDINAL
+
+
+class GeoIndex:
     """
-    Cette fonction récupère les données JSON depuis une URL spécifiée, adapte chaque événement et retourne une liste
-    d'événements adaptés sous forme JSON.
-    Elle effectue également une vérification des doublons avant d'insérer un événement.
+    Index géographique des événements adaptés : chaque événement est rangé dans une cellule de grille
+    de cell_deg degrés, et les événements sont triés par cellule. Une recherche ne lit que les cellules
+    qui recoupent le cercle demandé, puis calcule les distances exactes (haversine) de leurs seuls événements.
+
+    Les événements sans coordonnées valides sont ignorés. Les recherches peuvent être limitées à une période :
+    sont alors gardés les événements en cours pendant au moins un jour de la période.
 
     Args:
-        url (str): L'URL depuis laquelle récupérer les données JSON.
+        ids (array): Identifiants des événements.
+        latitudes, longitudes (array): Coordonnées en degrés.
+        start_days, end_days (array): date_debut et date_fin en jours depuis 1970 (-1 si inconnue).
+        cell_deg (float): Taille des cellules de la grille, en degrés.
+    """
+
+    def __init__(self, ids, latitudes, longitudes, start_days, end_days, cell_deg=0.1):
+        self.cell_deg = float(cell_deg)
+        self.columns = int(np.ceil(360 / self.cell_deg))
+        cells = self._cells(np.asarray(latitudes, dtype=np.float64), np.asarray(longitudes, dtype=np.float64))
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.ids = np.asarray(ids, dtype=str)[order]
+        self.latitudes = np.asarray(latitudes, dtype=np.float64)[order]
+        self.longitudes = np.asarray(longitudes, dtype=np.float64)[order]
+        self.start_days = np.asarray(start_days, dtype=np.int64)[order]
+        self.end_days = np.asarray(end_days, dtype=np.int64)[order]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _row(self, latitude):
+        return np.floor((np.clip(latitude, -90, 90) + 90) / self.cell_deg).astype(np.int64)
+
+    def _column(self, longitude):
+        return np.floor((np.asarray(longitude) + 180) / self.cell_deg).astype(np.int64) % self.columns
+
+    def _cells(self, latitudes, longitudes):
+        return self._row(latitudes) * self.columns + self._column(longitudes)
+
+    @classmethod
+    def from_events(cls, events, cell_deg=0.1):
+        """
+        Construit l'index à partir d'événements adaptés (voir adapt_event).
+
+        Args:
+            events (iterable): Événements adaptés ("id", "latitude", "longitude", "date_debut", "date_fin").
+            cell_deg (float): Taille des cellules de la grille, en degrés.
+
+        Returns:
+            GeoIndex: L'index.
+        """
+        ids, latitudes, longitudes, start_days, end_days = [], [], [], [], []
+        for event in events:
+            try:
+                latitude = float(event.get("latitude"))
+                longitude = float(event.get("longitude"))
+            except (TypeError, ValueError):
+                continue
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                continue
+            start_day = _epoch_day(event.get("date_debut"))
+            end_day = _epoch_day(event.get("date_fin"))
+            ids.append(event.get("id"))
+            latitudes.append(latitude)
+            longitudes.append(longitude)
+            start_days.append(-1 if start_day is None else start_day)
+            end_days.append(-1 if end_day is None else end_day)
+        return cls(ids, latitudes, longitudes, start_days, end_days, cell_deg)
+
+    def _candidates(self, latitude, longitude, radius_km):
+        # Indices des événements des cellules qui recoupent le cercle
+        radius = radius_km / EARTH_RADIUS_KM
+        radius_deg = np.degrees(radius)
+        first_row = self._row(latitude - radius_deg)
+        last_row = self._row(latitude + radius_deg)
+        column = int(self._column(longitude))
+        phi = np.radians(latitude)
+        if abs(phi) + radius >= np.pi / 2:
+            # Le cercle contient un pôle : toutes les longitudes sont concernées
+            first, last = 0, self.columns - 1
+        else:
+            # Écart de longitude maximal d'un point du cercle (atteint aux points de tangence des méridiens),
+            # le même pour toutes les rangées
+            delta = np.degrees(np.arcsin(np.sin(radius) / np.cos(phi)))
+            span = int(np.ceil(delta / self.cell_deg)) + 1
+            first, last = column - span, column + span
+        ranges = []
+        for row in range(int(first_row), int(last_row) + 1):
+            if last - first + 1 >= self.columns:
+                ranges.append((row * self.columns, row * self.columns + self.columns - 1))
+                continue
+            # Une plage qui traverse l'antiméridien est découpée en deux
+            for low, high in (
+                ((first, last),)
+                if 0 <= first and last < self.columns
+                else ((first % self.columns, self.columns - 1), (0, last % self.columns))
+            ):
+                ranges.append((row * self.columns + low, row * self.columns + high))
+
+        if not ranges:
+            return np.empty(0, dtype=np.int64)
+        bounds = np.asarray(ranges, dtype=np.int64)
+        starts = np.searchsorted(self.cells, bounds[:, 0], side="left")
+        ends = np.searchsorted(self.cells, bounds[:, 1], side="right")
+        return np.concatenate([np.arange(a, b) for a, b in zip(starts, ends)])
+
+    def _distances(self, indices, latitude, longitude):
+        lat1, lon1 = np.radians(latitude), np.radians(longitude)
+        lat2, lon2 = np.radians(self.latitudes[indices]), np.radians(self.longitudes[indices])
+        a = (
+            np.sin((lat2 - lat1) / 2) ** 2
+            + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        )
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+    def _in_period(self, indices, start, end):
+        start_day, end_day = _epoch_day(start), _epoch_day(end)
+        keep = np.ones(len(indices), dtype=bool)
+        if start_day is not None:
+            keep &= self.end_days[indices] >= start_day
+        if end_day is not None:
+            keep &= (self.start_days[indices] >= 0) & (self.start_days[indices] <= end_day)
+        return keep
+
+    def within(self, latitude, longitude, radius_km, start=None, end=None):
+        """
+        Renvoie les événements situés à moins de radius_km du point, du plus proche au plus lointain.
+
+        Args:
+            latitude, longitude (float): Le point, en degrés.
+            radius_km (float): Le rayon de recherche, en kilomètres.
+            start, end (str | date): Période (incluse) pendant laquelle les événements doivent avoir lieu (facultative).
+
+        Returns:
+            list: (id, distance en km) de chaque événement trouvé.
+        """
+        indices = self._candidates(latitude, longitude, radius_km)
+        indices = indices[self._in_period(indices, start, end)]
+        distances = self._distances(indices, latitude, longitude)
+        keep = distances <= radius_km
+        indices, distances = indices[keep], distances[keep]
+        order = np.argsort(distances, kind="stable")
+        return [(str(self.ids[i]), float(d)) for i, d in zip(indices[order], distances[order])]
+
+    def nearest(self, latitude, longitude, k=10, start=None, end=None, max_radius_km=None):
+        """
+        Renvoie les k événements les plus proches du point. Le rayon de recherche double jusqu'à en trouver k :
+        tout événement hors du cercle est plus loin que ceux qu'il contient.
+
+        Args:
+            latitude, longitude (float): Le point, en degrés.
+            k (int): Nombre d'événements voulus.
+            start, end (str | date): Période (incluse) pendant laquelle les événements doivent avoir lieu (facultative).
+            max_radius_km (float): Distance maximale (facultative).
+
+        Returns:
+            list: (id, distance en km) des k événements les plus proches (moins s'il n'y en a pas assez).
+        """
+        half_circumference = np.pi * EARTH_RADIUS_KM
+        limit = min(max_radius_km or half_circumference, half_circumference)
+        radius = min(limit, np.radians(self.cell_deg) * EARTH_RADIUS_KM)
+        while True:
+            found = self.within(latitude, longitude, radius, start, end)
+            if len(found) >= k or radius >= limit:
+                return found[:k]
+            radius = min(limit, radius * 2)
+
+    def save(self, path):
+        # Écrit dans un fichier temporaire puis le renomme : un lecteur ne voit jamais d'index à moitié écrit
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                cell_deg=self.cell_deg,
+                ids=self.ids,
+                latitudes=self.latitudes,
+                longitudes=self.longitudes,
+                start_days=self.start_days,
+                end_days=self.end_days,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(
+                data["ids"],
+                data["latitudes"],
+                data["longitudes"],
+                data["start_days"],
+                data["end_days"],
+                float(data["cell_deg"]),
+            )
+
+
+def build_geo_index(path=None):
+    """
+    Cette fonction construit l'index géographique des événements pas encore terminés à partir de la table BigQuery,
+    et le sauvegarde pour le service de recherche par lieu.
+
+    Args:
+        path (str): Chemin du fichier d'index, GEO_INDEX_PATH si None.
 
     Returns:
-        json: Liste d'événements adaptés sous forme JSON.
+        GeoIndex: L'index construit.
+    """
+    path = path or GEO_INDEX_PATH
+    client = bigquery.Client()
+    query = """
+        SELECT id, latitude, longitude, date_debut, date_fin
+        FROM `festa.evenement`
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+          AND (date_fin IS NULL OR date_fin >= CURRENT_DATE())
     """
-    fetchedData = fetch(url)
-    print("Données récupérées avec succès!")
+    index = GeoIndex.from_events(dict(row.items()) for row in client.query(query).result())
+    index.save(path)
+    print(f"Index géographique construit : {len(index)} événements.")
+    return index
 
-    existing_ids = check_for_duplicates()
 
-    # Séparation des événements en deux listes : nouveaux événements et événements déjà existants
-    new_events = [
-        event
-        for event in fetchedData["@graph"]
-        if event.get("@id", None) not in existing_ids
-    ]
-    existing_events = [
-        event
-        for event in fetchedData["@graph"]
-        if event.get("@id", None) in existing_ids
-    ]
+# ===================================================================================================
+#                                        CHECKPOINT
+# ===================================================================================================
+
+
+class Checkpoint:
+    """
+    Point de reprise d'une exécution de process_event_data, enregistré dans un fichier JSON.
+
+    `offset` est le nombre de noeuds "@graph" entièrement traités (lignes envoyées à BigQuery),
+    `last_id` le "@id" du dernier d'entre eux : à la reprise, les `offset` premiers noeuds sont sautés
+    si le flux commence toujours de la même manière. Les noeuds d'un segment interrompu sont relus à la reprise :
+    ceux dont les lignes avaient déjà été envoyées sont écartés par l'index des doublons, que process_event_data
+    enregistre même quand une erreur arrête l'exécution.
+
+    Args:
+        path (str): Le fichier du point de reprise.
+        feed (str): Empreinte de l'URL du flux (la clé d'API n'est pas enregistrée en clair).
+    """
+
+    def __init__(self, path, feed):
+        self.path = path
+        self.feed = feed
+        self.offset = 0
+        self.last_id = None
+        self.batches_flushed = 0
+        self.inserted = 0
+        self.complete = False
+        self.started_at = time.time()
+        self.updated_at = None
+        self.read = 0
+        self.read_last_id = None
+        self.exhausted = False
+
+    @staticmethod
+    def feed_key(url):
+        return hashlib.blake2b(url.encode("utf-8"), digest_size=8).hexdigest()
+
+    @classmethod
+    def load(cls, path, url, max_age_hours=CHECKPOINT_MAX_AGE_HOURS):
+        """
+        Charge le point de reprise du flux, ou en crée un nouveau s'il n'y en a pas, s'il concerne
+        un autre flux, s'il est terminé ou s'il est plus ancien que max_age_hours.
+
+        Args:
+            path (str): Le fichier du point de reprise.
+            url (str): L'URL du flux.
+            max_age_hours (float): Âge maximal d'un point de reprise réutilisable.
+
+        Returns:
+            Checkpoint: Le point de reprise.
+        """
+        checkpoint = cls(path, cls.feed_key(url))
+        try:
+            with open(path) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            return checkpoint
+
+        age_hours = (time.time() - state.get("updated_at", 0)) / 3600
+        if state.get("feed") != checkpoint.feed or state.get("complete") or age_hours > max_age_hours:
+            return checkpoint
+
+        checkpoint.offset = state.get("offset", 0)
+        checkpoint.last_id = state.get("last_id")
+        checkpoint.batches_flushed = state.get("batches_flushed", 0)
+        checkpoint.inserted = state.get("inserted", 0)
+        checkpoint.started_at = state.get("started_at", checkpoint.started_at)
+        return checkpoint
+
+    def save(self):
+        self.updated_at = time.time()
+        state = {
+            "feed": self.feed,
+            "offset": self.offset,
+            "last_id": self.last_id,
+            "batches_flushed": self.batches_flushed,
+            "inserted": self.inserted,
+            "complete": self.complete,
+            "started_at": self.started_at,
+            "updated_at": self.updated_at,
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def track(self, nodes):
+        # Compte les noeuds lus ; ils ne deviennent le point de reprise qu'au prochain commit().
+        # `exhausted` ne passe à True que si `nodes` s'est terminé sans erreur, donc après la lecture
+        # du "]" et du "}" finaux par iter_graph_nodes : un flux tronqué n'est jamais marqué terminé.
+        self.read = 0
+        self.read_last_id = None
+        self.exhausted = False
+        for node in nodes:
+            self.read += 1
+            self.read_last_id = node.get("@id")
+            yield node
+        self.exhausted = True
+
+    def skip(self, nodes):
+        """
+        Saute les noeuds déjà traités de `nodes` (renvoyé par track).
+
+        Returns:
+            bool: False si le flux ne commence plus par les mêmes noeuds : il faut alors le relire depuis le début.
+        """
+        for _ in itertools.islice(nodes, self.offset):
+            pass
+        return self.read == self.offset and self.read_last_id == self.last_id
+
+    def reset(self):
+        self.offset = 0
+        self.last_id = None
+        self.batches_flushed = 0
+        self.inserted = 0
+        self.started_at = time.time()
+
+    def commit(self, batches_flushed, inserted):
+        self.offset = self.read
+        self.last_id = self.read_last_id
+        self.batches_flushed = batches_flushed
+        self.inserted = inserted
+        self.save()
+
+
+# ===================================================================================================
+# *                                    PROCESS_EVENT_DATA
+# ===================================================================================================
+
+
+def prefilter_events(
+    events, existing_ids, stats, skip_existing=True, shard_index=0, shard_count=1
+):
+    """
+    Cette fonction écarte au plus tôt les événements inutiles, en ne lisant que "@id" et "rdfs:label" :
+    d'abord ceux des autres partitions, puis les doublons, puis les titres refusés par les listes blanche et noire.
+    Seuls les survivants passent par adapt_event, beaucoup plus coûteux.
+
+    Args:
+        events (iterable): Les noeuds "@graph" du flux.
+        existing_ids (set): Les identifiants ("@id") des événements déjà présents.
+        stats (dict): Compteurs mis à jour au passage ("existing_events", "new_events", "keyword_rejected").
+        skip_existing (bool): False pour garder les événements déjà présents (détection des modifications).
+        shard_index (int): Partition traitée (voir shard_of).
+        shard_count (int): Nombre de partitions (1 pour tout traiter).
+
+    Yields:
+        tuple: (événement, résultat de keyword_matcher.match) pour chaque événement retenu.
+    """
+    for event in events:
+        if shard_count > 1 and shard_of(event.get("@id"), shard_count) != shard_index:
+            stats["other_shard_events"] += 1
+            continue
+        if event.get("@id", None) in existing_ids:
+            stats["existing_events"] += 1
+            if skip_existing:
+                continue
+        else:
+            stats["new_events"] += 1
+
+        label = event.get("rdfs:label")
+        titre = label.get("@value", None) if isinstance(label, dict) else None
+        keywords = keyword_matcher.match(normalize_text(titre))
+        autorise, interdit, _ = keywords
+        if not autorise or interdit:
+            stats["keyword_rejected"] += 1
+            continue
+        yield event, keywords
 
-    print(f"Il y a {len(new_events)} événements dans new_events")
-    print(f"Il y a {len(existing_events)} événements dans existing_events")
 
-    adapted_events = []
-    ignored_events = []
+def adapt_events(events, stats, resolve_regions=True):
+    """
+    Cette fonction adapte les événements un par un et ne renvoie que ceux qui ont été retenus.
+
+    Args:
+        events (iterable): Les (événement, mots clés) renvoyés par prefilter_events.
+        stats (dict): Compteurs mis à jour au passage ("adapted_events", "ignored_events").
+        resolve_regions (bool): Transmis à adapt_event.
 
-    for event in new_events:
-        adapted_event, ignored_event = adapt_event(event)
+    Yields:
+        dict: Chaque événement adapté pour BigQuery.
+    """
+    for event, keywords in events:
+        adapted_event, ignored_event = adapt_event(
+            event, resolve_regions=resolve_regions, keywords=keywords
+        )
         if adapted_event is not None:
-            # print(adapted_event)
-            insert_into_bigquery(adapted_event)
-            adapted_events.append(adapted_event)
+            stats["adapted_events"] += 1
+            yield adapted_event
         if ignored_event is not None:
-            # insert_into_bigquery(ignored_event)
-            print(ignored_event)
-            ignored_events.append(ignored_event)
+            stats["ignored_events"] += 1
+
+
+def batched(iterable, size):
+    """
+    Cette fonction regroupe les éléments d'un itérable en listes de size éléments (la dernière peut être plus courte).
+
+    Args:
+        iterable (iterable): Les éléments à regrouper.
+        size (int): Taille des lots.
+
+    Yields:
+        list: Chaque lot.
+    """
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _adapt_event_task(item):
+    # Exécutée dans un processus de travail : seul l'événement adapté (ou None) est renvoyé au processus principal
+    event, keywords = item
+    adapted_event, _ = adapt_event(event, resolve_regions=False, keywords=keywords)
+    return adapted_event
+
+
+def adapt_events_parallel(events, stats, workers=None, chunksize=64, ordered=True, pool=None):
+    """
+    Cette fonction adapte les événements sur plusieurs coeurs avec un pool de processus. Les événements sont
+    distribués par paquets de chunksize, et l'entrée est lue par fenêtres de workers * chunksize * 4 événements
+    pour que la mémoire reste bornée quelle que soit la taille du flux.
+    Les régions ne sont pas résolues dans les processus de travail (voir enrich_regions).
+
+    Args:
+        events (iterable): Les (événement, mots clés) renvoyés par prefilter_events.
+        stats (dict): Compteurs mis à jour au passage ("adapted_events", "ignored_events").
+        workers (int): Nombre de processus, le nombre de coeurs si None.
+        chunksize (int): Nombre d'événements envoyés à la fois à un processus.
+        ordered (bool): True pour renvoyer les événements dans l'ordre du flux, False pour les renvoyer
+            dès qu'ils sont prêts.
+        pool (multiprocessing.Pool): Pool de processus à réutiliser d'un appel à l'autre (un par exécution
+            de process_event_data). S'il est absent, un pool est créé puis fermé pour cet appel.
+
+    Yields:
+        dict: Chaque événement adapté pour BigQuery.
+    """
+    workers = workers or os.cpu_count() or 1
+    if pool is None:
+        with multiprocessing.Pool(workers) as pool:
+            yield from adapt_events_parallel(events, stats, workers, chunksize, ordered, pool)
+        return
+
+    imap = pool.imap if ordered else pool.imap_unordered
+    for window in batched(events, workers * chunksize * 4):
+        for adapted_event in imap(_adapt_event_task, window, chunksize):
+            if adapted_event is not None:
+                stats["adapted_events"] += 1
+                yield adapted_event
+            else:
+                stats["ignored_events"] += 1
+
+
+def classify_changes(adapted_events, existing_ids, stats):
+    """
+    Cette fonction calcule l'empreinte de chaque événement adapté (colonne empreinte) et le compare à l'index
+    des doublons : "new" s'il est absent de la table, "changed" si son contenu a changé depuis son insertion,
+    "unchanged" sinon. Les événements inchangés sont écartés.
+
+    Args:
+        adapted_events (iterable): Les événements adaptés, avec leur région.
+        existing_ids (DedupeIndex): L'index des événements déjà présents.
+        stats (dict): Compteurs mis à jour au passage ("changed_events", "unchanged_events").
+
+    Yields:
+        tuple: ("new" ou "changed", événement adapté).
+    """
+    for adapted_event in adapted_events:
+        adapted_event["empreinte"] = fingerprint_event(adapted_event)
+        source = adapted_event["source"]
+
+        if source not in existing_ids:
+            yield "new", adapted_event
+        elif existing_ids.empreinte(source) != adapted_event["empreinte"]:
+            stats["changed_events"] += 1
+            yield "changed", adapted_event
+        else:
+            stats["unchanged_events"] += 1
+
+
+def enrich_regions_in_batches(adapted_events, batch_size):
+    """
+    Cette fonction regroupe les événements adaptés par lots de batch_size, complète leurs régions
+    avec enrich_regions, puis les renvoie un par un.
+
+    Args:
+        adapted_events (iterable): Les événements adaptés avec resolve_regions=False.
+        batch_size (int): Taille des lots.
+
+    Yields:
+        dict: Chaque événement adapté, avec sa région.
+    """
+    for batch in batched(adapted_events, batch_size):
+        yield from enrich_regions(batch)
+
+
+def process_event_data(
+    url,
+    stream=True,
+    batch_size=500,
+    bulk=False,
+    writer=None,
+    detect_changes=False,
+    workers=1,
+    ordered=True,
+    checkpoint_path=None,
+    checkpoint_every=5000,
+    time_budget=None,
+    shard_index=0,
+    shard_count=1,
+):
+    """
+    Cette fonction récupère les données JSON depuis une URL spécifiée, adapte chaque événement et l'insère dans BigQuery.
+    Elle effectue également une vérification des doublons avant d'insérer un événement.
+
+    Les événements traversent une chaîne de générateurs (lecture -> doublons et mots clés -> adaptation -> régions -> insertion) :
+    en mode streaming, un seul noeud "@graph" est en mémoire à la fois, quelle que soit la taille du flux.
+    Les insertions sont regroupées par lots de batch_size lignes via BigQueryWriter, ou, en mode bulk,
+    écrites dans un fichier de préparation chargé par un seul job BigQuery (BigQueryLoadWriter).
+
+    Args:
+        url (str): L'URL depuis laquelle récupérer les données JSON.
+        stream (bool): True pour lire le flux en streaming, False pour le télécharger en entier avec fetch.
+        batch_size (int): Nombre maximal de lignes par requête d'insertion.
+        bulk (bool): True pour charger tous les événements avec un seul job de chargement (rechargements complets).
+        writer (EventWriter): Écrivain à utiliser à la place de BigQuery (par exemple un NdjsonFileWriter pour les tests).
+        detect_changes (bool): True pour adapter aussi les événements déjà présents et réécrire, par un MERGE groupé,
+            ceux dont le contenu a changé (voir classify_changes).
+        workers (int): Nombre de processus pour l'adaptation (voir adapt_events_parallel), None pour tous les coeurs.
+            Le pool est créé une fois pour toute l'exécution, et non à chaque segment.
+        ordered (bool): Avec plusieurs processus, False pour insérer les événements dès qu'ils sont adaptés
+            plutôt que dans l'ordre du flux.
+        checkpoint_path (str): Fichier du point de reprise (voir Checkpoint). Le flux est alors traité par segments
+            de checkpoint_every noeuds, envoyés à BigQuery puis enregistrés comme traités : une exécution
+            interrompue reprend après le dernier segment terminé.
+        checkpoint_every (int): Nombre de noeuds par segment.
+        time_budget (float): Durée maximale en secondes : l'exécution s'arrête proprement après le segment en cours,
+            et la suivante reprend à partir du point de reprise. Nécessite checkpoint_path.
+        shard_index (int): Partition traitée par cette exécution, entre 0 et shard_count - 1.
+        shard_count (int): Nombre de partitions : chaque exécution lit tout le flux mais n'adapte et n'insère
+            que les événements dont le "@id" tombe dans sa partition (voir shard_of).
+
+    Returns:
+        str: Message de fin de traitement.
+    """
+    if checkpoint_path and bulk:
+        raise ValueError(
+            "Le mode bulk ne charge les lignes qu'à la fin : il ne peut pas être repris en cours de route."
+        )
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(
+            f"shard_index doit être compris entre 0 et {shard_count - 1}, pas {shard_index}."
+        )
+    # Chaque partition a ses propres index et point de reprise, limités à ses sources
+    checkpoint_path = shard_path(checkpoint_path, shard_index, shard_count)
+    dedupe_index_path = shard_path(DEDUPE_INDEX_PATH, shard_index, shard_count)
+    started = time.monotonic()
+    existing_ids = load_dedupe_index(dedupe_index_path, shard_index=shard_index, shard_count=shard_count)
+
+    def open_nodes():
+        if stream:
+            return stream_graph(url)
+        data = fetch(url)
+        if "@graph" not in data:
+            # fetch a déjà affiché l'erreur : rien n'est inséré et l'exécution est signalée en échec
+            raise ValueError("Le flux n'a pas pu être récupéré.")
+        print("Données récupérées avec succès!")
+        return data["@graph"]
+
+    checkpoint = (
+        Checkpoint.load(checkpoint_path, f"{url}#{shard_index}/{shard_count}")
+        if checkpoint_path
+        else None
+    )
+    if checkpoint is None:
+        segments = [open_nodes()]
+    else:
+        nodes = checkpoint.track(open_nodes())
+        if checkpoint.offset:
+            if checkpoint.skip(nodes):
+                print(f"Reprise après {checkpoint.offset} noeuds déjà traités")
+            else:
+                print("Le flux a changé depuis le point de reprise : reprise depuis le début")
+                checkpoint.reset()
+                nodes = checkpoint.track(open_nodes())
+        # Chaque segment lit les checkpoint_every noeuds suivants du même itérateur
+        segments = iter(lambda: itertools.islice(nodes, checkpoint_every), None)
+        batches_before, inserted_before = checkpoint.batches_flushed, checkpoint.inserted
+
+    stats = {
+        "new_events": 0,
+        "existing_events": 0,
+        "keyword_rejected": 0,
+        "adapted_events": 0,
+        "ignored_events": 0,
+        "changed_events": 0,
+        "unchanged_events": 0,
+        "other_shard_events": 0,
+    }
+
+    if writer is None:
+        writer = BigQueryLoadWriter() if bulk else BigQueryWriter(max_rows=batch_size)
+    if writer.on_success is None:
+        writer.on_success = existing_ids.record
+    merge_writer = (
+        MergeWriter(
+            on_success=existing_ids.record,
+            # Une table de travail par partition : elles sont écrasées à chaque lot
+            staging_table_id=(
+                "evenement_maj"
+                if shard_count == 1
+                else f"evenement_maj_{shard_index}_{shard_count}"
+            ),
+        )
+        if detect_changes
+        else None
+    )
+
+    pool = multiprocessing.Pool(workers or os.cpu_count() or 1) if workers != 1 else None
+    interrupted = False
+    try:
+        with writer:
+            for segment in segments:
+                read_before = checkpoint.read if checkpoint else 0
+                candidates = prefilter_events(
+                    segment,
+                    existing_ids,
+                    stats,
+                    skip_existing=not detect_changes,
+                    shard_index=shard_index,
+                    shard_count=shard_count,
+                )
+                if workers == 1:
+                    adapted_events = adapt_events(candidates, stats, resolve_regions=False)
+                else:
+                    adapted_events = adapt_events_parallel(
+                        candidates, stats, workers=workers, ordered=ordered, pool=pool
+                    )
+                enriched_events = enrich_regions_in_batches(adapted_events, batch_size)
+                if detect_changes:
+                    classified_events = classify_changes(enriched_events, existing_ids, stats)
+                else:
+                    # Sans détection des modifications, la colonne empreinte n'est pas écrite :
+                    # elle peut ne pas encore exister dans la table
+                    classified_events = (("new", event) for event in enriched_events)
 
-    # print(ignored_events)
+                for status, adapted_event in classified_events:
+                    if status == "new":
+                        writer.insert(adapted_event)
+                    else:
+                        merge_writer.insert(adapted_event)
+
+                if checkpoint is None:
+                    continue
+
+                # Le segment n'est enregistré comme traité qu'une fois ses lignes envoyées
+                writer.flush()
+                batches = writer.requests
+                if merge_writer is not None:
+                    merge_writer.flush()
+                    batches += merge_writer.requests
+                if dedupe_index_path:
+                    existing_ids.save(dedupe_index_path)
+                # Le flux n'est terminé que s'il a été lu jusqu'au bout : une erreur de lecture
+                # remonte jusqu'ici et laisse le point de reprise au dernier segment enregistré
+                checkpoint.complete = checkpoint.exhausted
+                checkpoint.commit(batches_before + batches, inserted_before + writer.inserted)
+                if checkpoint.complete or checkpoint.read == read_before:
+                    break
+                if time_budget and time.monotonic() - started > time_budget:
+                    interrupted = True
+                    break
+            if merge_writer is not None:
+                merge_writer.close()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        # Enregistré même si une erreur interrompt l'exécution : les lignes déjà envoyées (y compris par abort)
+        # doivent être dans l'index, sinon l'exécution suivante les réinsérerait
+        if dedupe_index_path:
+            existing_ids.save(dedupe_index_path)
+
+    if shard_count > 1:
+        print(
+            f"Partition {shard_index + 1}/{shard_count} : "
+            f"{stats['other_shard_events']} événements laissés aux autres partitions"
+        )
+    print(f"Il y a {stats['new_events']} événements dans new_events")
+    print(f"Il y a {stats['existing_events']} événements dans existing_events")
+    print(f"{stats['keyword_rejected']} événements écartés par les listes de mots clés")
+    print(
+        f"{stats['adapted_events']} événements adaptés, {stats['ignored_events']} événements ignorés"
+    )
+    print(
+        f"{writer.inserted} événements insérés en {writer.requests} requêtes, {len(writer.errors)} en erreur"
+    )
+    if merge_writer is not None:
+        print(
+            f"{stats['changed_events']} événements modifiés ({merge_writer.inserted} réécrits), "
+            f"{stats['unchanged_events']} inchangés"
+        )
+    if interrupted:
+        return (
+            f"Durée maximale atteinte après {checkpoint.offset} noeuds : "
+            "la prochaine exécution reprendra à partir de là."
+        )
     return "Les événements existants ont été ignorés. L'insertion est terminée !"
 
 # ===================================================================================================
 # *                                    CATEGORIZE_FESTIVAL
 # ===================================================================================================
-def categorize_festival(title: str, description: str) -> str:
-    keywords = {
-        "feria": ["feria", "féria", "ferias"],
-        "fest-noz": ["fest-noz", "fest noz", "noz", "deiz"],
-        "carnaval": ["carnaval"],
-        "fete_de_village": [
-            "village",
-            "communal",
-            "communale",
-            "villageois",
-            "municipal",
-            "municipale",
-            "fête locale",
-            "fête votive",
-            "fête patronale",
-            "en fête",
-            "fete locale",
-            "fete votive",
-            "fete patronale",
-        ],
-        "festival": ["festival", "estival"],
-        "guinguette": ["guinguette", "apéro", "apero"],
-        "bal_populaire": ["bal", "folk", "bals", "folks"],
-        "foire_artisanale": ["foire artisanale", "foire", "marché", "marché nocturne"],
-        "fete_medievale": ["médievale", "médiévale", "medieval"],
-    }
+# Mots clés de chaque catégorie, par ordre de priorité
+festivalKeywords = {
+    "feria": ["feria", "féria", "ferias"],
+    "fest-noz": ["fest-noz", "fest noz", "noz", "deiz"],
+    "carnaval": ["carnaval"],
+    "fete_de_village": [
+        "village",
+        "communal",
+        "communale",
+        "villageois",
+        "municipal",
+        "municipale",
+        "fête locale",
+        "fête votive",
+        "fête patronale",
+        "en fête",
+        "fete locale",
+        "fete votive",
+        "fete patronale",
+    ],
+    "festival": ["festival", "estival"],
+    "guinguette": ["guinguette", "apéro", "apero"],
+    "bal_populaire": ["bal", "folk", "bals", "folks"],
+    "foire_artisanale": ["foire artisanale", "foire", "marché", "marché nocturne"],
+    "fete_medievale": ["médievale", "médiévale", "medieval"],
+}
+
+# Aliments reconnus dans "fête du/de la/... <aliment>"
+foodKeywords = [
+    "jambon",
+    "choucroute",
+    "ananas",
+    "vin",
+    "patate",
+    "fromage",
+    "citrouille",
+    "pain",
+    "poulet",
+    "agneau",
+    "fruit",
+    "légume",
+    "bière",
+    "huîtres",
+    "saucisson",
+    "truffe",
+    "charcuterie",
+    "chocolat",
+    "confiture",
+    "miel",
+    "moutarde",
+    "olive",
+    "pâté",
+    "pâtisserie",
+    "crêpe",
+    "galette",
+    "gastronomie",
+    "cuisine",
+    "terroir",
+    "châtaigne",
+    "champignon",
+    "cidre",
+    "saucisse",
+    "rôti",
+    "poisson",
+    "seafood",
+    "mer",
+    "coquillage",
+    "crustacé",
+    "fruit de mer",
+    "moule",
+    "huître",
+    "poisson",
+    "homard",
+    "canard",
+    "foie gras",
+    "porc",
+    "veau",
+    "boeuf",
+    "agneau",
+    "mouton",
+    "légumes",
+    "fruits",
+    "salade",
+    "tomate",
+    "oignon",
+    "ail",
+    "épice",
+    "pomme",
+    "poire",
+    "cerise",
+    "fraise",
+    "framboise",
+    "mûre",
+    "myrtille",
+    "pêche",
+    "abricot",
+    "prune",
+    "raisin",
+    "vigne",
+    "fromage",
+    "yaourt",
+    "lait",
+    "beurre",
+    "crème",
+    "riz",
+    "pâtes",
+    "gnocchi",
+    "lasagne",
+    "pizza",
+    "tarte",
+    "quiche",
+    "cake",
+    "biscuit",
+    "gâteau",
+    "glace",
+    "sorbet",
+    "miel",
+    "sucre",
+    "confiserie",
+    "bonbon",
+    "chocolat",
+    "caramel",
+    "nougat",
+    "praliné",
+    "vin",
+    "bière",
+    "cidre",
+    "liqueur",
+    "eau-de-vie",
+    "spiritueux",
+    "cocktail",
+    "café",
+    "thé",
+    "infusion",
+    "jus",
+    "sardine",
+    "soda",
+    "limonade",
+    "eau",
+    "boisson",
+    "champagne",
+    "caviar",
+    "truffe",
+    "boulangerie",
+    "pâtisserie",
+    "sardine",
+    "huître",
+    "boeufs",
+    "soupe",
+    "marron",
+    "châtaignes",
+    "amande",
+]
 
-    food_keywords = [
-        "jambon",
-        "choucroute",
-        "ananas",
-        "vin",
-        "patate",
-        "fromage",
-        "citrouille",
-        "pain",
-        "poulet",
-        "agneau",
-        "fruit",
-        "légume",
-        "bière",
-        "huîtres",
-        "saucisson",
-        "truffe",
-        "charcuterie",
-        "chocolat",
-        "confiture",
-        "miel",
-        "moutarde",
-        "olive",
-        "pâté",
-        "pâtisserie",
-        "crêpe",
-        "galette",
-        "gastronomie",
-        "cuisine",
-        "terroir",
-        "châtaigne",
-        "champignon",
-        "cidre",
-        "saucisse",
-        "rôti",
-        "poisson",
-        "seafood",
-        "mer",
-        "coquillage",
-        "crustacé",
-        "fruit de mer",
-        "moule",
-        "huître",
-        "poisson",
-        "homard",
-        "canard",
-        "foie gras",
-        "porc",
-        "veau",
-        "boeuf",
-        "agneau",
-        "mouton",
-        "légumes",
-        "fruits",
-        "salade",
-        "tomate",
-        "oignon",
-        "ail",
-        "épice",
-        "pomme",
-        "poire",
-        "cerise",
-        "fraise",
-        "framboise",
-        "mûre",
-        "myrtille",
-        "pêche",
-        "abricot",
-        "prune",
-        "raisin",
-        "vigne",
-        "fromage",
-        "yaourt",
-        "lait",
-        "beurre",
-        "crème",
-        "riz",
-        "pâtes",
-        "gnocchi",
-        "lasagne",
-        "pizza",
-        "tarte",
-        "quiche",
-        "cake",
-        "biscuit",
-        "gâteau",
-        "glace",
-        "sorbet",
-        "miel",
-        "sucre",
-        "confiserie",
-        "bonbon",
-        "chocolat",
-        "caramel",
-        "nougat",
-        "praliné",
-        "vin",
-        "bière",
-        "cidre",
-        "liqueur",
-        "eau-de-vie",
-        "spiritueux",
-        "cocktail",
-        "café",
-        "thé",
-        "infusion",
-        "jus",
-        "sardine",
-        "soda",
-        "limonade",
-        "eau",
-        "boisson",
-        "champagne",
-        "caviar",
-        "truffe",
-        "boulangerie",
-        "pâtisserie",
-        "sardine",
-        "huître",
-        "boeufs",
-        "soupe",
-        "marron",
-        "châtaignes",
-        "amande"
-    ]
+determinants = ["du", "de la", "la", "le", "des", "de"]
 
+
+def categorize_festival(title: str, description: str) -> str:
     #Traite le cas ou description est vide aussi
     all_text = (str(title if title else "") + " " + str(description if description else "")).lower()
 
@@ -860,16 +3130,13 @@ def categorize_festival(title: str, description: str) -> str:
 
     print(all_text)
 
-    determinants = ["du", "de la", "la", "le", "des", "de"]
-
-
     #------------------------
     # ? FETE GASTRONOMIQUE
     #---------------------------
     words = all_text.split()
     for i in range(2, len(words)):  # commencer à 2 car on vérifie toujours 2 mots avant
         if (
-            words[i] in food_keywords
+            words[i] in foodKeywords
             and words[i - 1] in determinants
             and words[i - 2] == "fête"
         ):
@@ -879,7 +3146,7 @@ def categorize_festival(title: str, description: str) -> str:
     # ?       FETES
     #---------------------------
 
-    for category, keys in keywords.items():
+    for category, keys in festivalKeywords.items():
         for key in keys:
             if key in all_text:
                 return category
@@ -889,7 +3156,77 @@ def categorize_festival(title: str, description: str) -> str:
     #---------------------------
     return "autres"
 
-    
+
+# "fête <déterminant> <aliment>" sur des mots entiers séparés par des blancs, comme dans categorize_festival
+# (seuls les aliments et déterminants d'un seul mot peuvent y correspondre). L'expression commence par le texte
+# "fête", la limite de mot étant vérifiée après coup, pour que le moteur saute directement à ses occurrences.
+_FOOD_FESTIVAL_PATTERN = re.compile(
+    r"fête(?<!\Sfête)\s+(?:"
+    + "|".join(re.escape(word) for word in determinants if len(word.split()) == 1)
+    + r")\s+(?:"
+    + "|".join(re.escape(word) for word in foodKeywords if len(word.split()) == 1)
+    + r")(?!\S)"
+)
+
+# Mots clés utiles de chaque catégorie : un mot clé qui en contient un autre de la même catégorie
+# ("communale" contient "communal") ne change pas le résultat d'une recherche de sous-chaîne
+_CATEGORY_KEYS = {
+    category: [
+        key
+        for key in dict.fromkeys(keys)
+        if not any(other != key and other in key for other in keys)
+    ]
+    for category, keys in festivalKeywords.items()
+}
+
+
+def categorize_festivals(titles, descriptions):
+    """
+    Version vectorisée de categorize_festival : catégorise toute une série de titres et de descriptions.
+    Chaque test (fête gastronomique, puis chaque mot clé par ordre de priorité) est une seule recherche en C par
+    ligne, sans boucle Python sur les occurrences de "fête", et n'est appliqué qu'aux lignes encore sans
+    catégorie : la plupart des lignes sont tranchées par les premiers mots clés et ne sont plus parcourues ensuite.
+    Les catégories renvoyées sont identiques à celles de categorize_festival.
+
+    Args:
+        titles (pd.Series or list): Les titres.
+        descriptions (pd.Series or list): Les descriptions (même longueur que titles).
+
+    Returns:
+        pd.Series: La catégorie de chaque ligne, avec l'index de titles s'il s'agit d'une Series.
+    """
+    index = titles.index if isinstance(titles, pd.Series) else None
+    titles = pd.Series(list(titles), dtype=object).fillna("").astype(str)
+    descriptions = pd.Series(list(descriptions), dtype=object).fillna("").astype(str)
+    # Même texte que categorize_festival : minuscules, sans "l'"
+    rows = np.array(
+        [
+            f"{title} {description}".lower().replace("l'", "")
+            for title, description in zip(titles.tolist(), descriptions.tolist())
+        ],
+        dtype=object,
+    )
+
+    categories = np.full(len(rows), "autres", dtype=object)
+    # Lignes encore sans catégorie
+    remaining = np.arange(len(rows))
+
+    def assign(category, matches):
+        nonlocal remaining
+        found = np.fromiter(matches, dtype=bool, count=len(remaining))
+        categories[remaining[found]] = category
+        remaining = remaining[~found]
+
+    # Même ordre de priorité que categorize_festival : fête gastronomique, puis chaque catégorie
+    search = _FOOD_FESTIVAL_PATTERN.search
+    assign("fete_gastronomique", (search(row) is not None for row in rows[remaining]))
+    for category, keys in _CATEGORY_KEYS.items():
+        for key in keys:
+            assign(category, (key in row for row in rows[remaining]))
+
+    return pd.Series(categories, index=index if index is not None else titles.index)
+
+
 def main(request):
     # Initialize a BigQuery client
     client = bigquery.Client()
@@ -911,27 +3248,43 @@ def main(request):
 
     try:
         # Apply the function 'categorize_festival' to each row in the DataFrame
-        df['new_categorie'] = df.apply(lambda row: categorize_festival(row['titre'], row['description']), axis=1)
-        print("Applied 'categorize_festival' function to DataFrame.")
+        df['new_categorie'] = categorize_festivals(df['titre'], df['description'])
+        print("Applied 'categorize_festivals' function to DataFrame.")
     except Exception as e:
-        print(f"Error applying 'categorize_festival' function: {e}")
-        return "Error applying 'categorize_festival' function"
+        print(f"Error applying 'categorize_festivals' function: {e}")
+        return "Error applying 'categorize_festivals' function"
 
     # Print some sample rows
     print(df.head())
 
-    for index, row in df.iterrows():
-        update_query = f"""
-        UPDATE `festalocal.festa.evenement`
-        SET categorie = '{row['new_categorie']}'
-        WHERE id = '{row['id']}'
-        """
+    if df.empty:
+        return "Modification effectuée"
 
-        try:
-            client.query(update_query)
-            print(f"Updated row {row['id']} successfully.")
-        except Exception as e:
-            print(f"Error updating row {row['id']}: {e}")
+    # Les couples (id, nouvelle catégorie) sont chargés dans une table de travail,
+    # puis appliqués en une seule requête MERGE au lieu d'un UPDATE par ligne
+    updates = [
+        {"id": row_id, "categorie": categorie}
+        for row_id, categorie in zip(df["id"], df["new_categorie"])
+    ]
+    merge_query = """
+    MERGE `festalocal.festa.evenement` T
+    USING `festalocal.festa.evenement_categorie_maj` S
+    ON T.id = S.id
+    WHEN MATCHED THEN UPDATE SET categorie = S.categorie
+    """
+
+    try:
+        load_rows_to_table(
+            client,
+            updates,
+            "festalocal.festa.evenement_categorie_maj",
+            [SchemaField("id", "STRING"), SchemaField("categorie", "STRING")],
+        )
+        client.query(merge_query).result()
+        print(f"Updated {len(updates)} rows successfully.")
+    except Exception as e:
+        print(f"Error updating rows: {e}")
+        return "Error updating rows"
 
     return "Modification effectuée"
 
@@ -970,14 +3323,52 @@ def cloud_function(request):
             400,
         )
 
+    # Partition traitée par cette instance (?shard_index=0&shard_count=4), tout le flux par défaut
+    try:
+        shard_index = int(request.args.get("shard_index", 0))
+        shard_count = int(request.args.get("shard_count", 1))
+    except ValueError:
+        shard_index, shard_count = -1, 1
+    if not 0 <= shard_index < shard_count:
+        return (
+            jsonify(
+                {
+                    "error": "Invalid shard. shard_index must be between 0 and shard_count - 1."
+                }
+            ),
+            400,
+        )
+
     # Concatenate the base URL with the API key to form the complete URL
     url = base_url + key
 
-    # Suppression des événements expirés
-    delete_expired_events()
+    # Suppression des événements expirés (une seule fois quand le flux est partagé entre plusieurs instances),
+    # y compris dans les index des dates de toutes les partitions
+    if shard_index == 0:
+        delete_expired_events(
+            [shard_path(DATE_INDEX_PATH, index, shard_count) for index in range(shard_count)]
+        )
+
+    # Préchargement du cache des régions (s'il existe)
+    prewarm_region_cache(REGION_CACHE_PATH)
 
     # Call the main function with the URL to fetch data and return the result in JSON format
-    process_event_data(url)
+    # Une exécution interrompue (délai dépassé) reprend au dernier point de reprise
+    message = process_event_data(
+        url,
+        checkpoint_path=CHECKPOINT_PATH,
+        time_budget=RUN_TIME_BUDGET or None,
+        shard_index=shard_index,
+        shard_count=shard_count,
+    )
+    print(message)
+
+    # Les régions résolues pendant cette exécution serviront à la suivante
+    try:
+        save_region_cache(REGION_CACHE_PATH)
+    except OSError as e:
+        print(f"Le cache des régions n'a pas pu être enregistré : {e}")
+
     print("Terminé !")
     return "Terminé !"
 
@@ -0,0 +1,495 @@
+# ===================================================================================================
+# *                                         HTTP_CLIENT
+# ===================================================================================================
+
+# Client HTTP partagé par cloud.py, main.py et openagenda/api1.py : délai d'attente, reprises et limitation
+# par hôte, et cache disque des réponses. Module séparé pour que les scripts n'aient pas à importer
+# toute la Cloud Function.
+
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from email.utils import parsedate_to_datetime  # Utilisé pour lire l'en-tête Retry-After sous forme de date.
+from urllib.parse import urlsplit
+
+import requests
+
+# Requêtes HTTP : délai d'attente (secondes), nombre de reprises et requêtes par seconde par hôte
+HTTP_TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "30"))
+HTTP_MAX_RETRIES = int(os.environ.get("HTTP_MAX_RETRIES", "5"))
+HTTP_RATE = float(os.environ.get("HTTP_RATE", "10"))
+
+# Cache disque des réponses HTTP : dossier, durée de conservation (secondes) et taille maximale (octets).
+# Désactivé si HTTP_CACHE_DIR n'est pas défini : le flux national copié dans /tmp (gardé en mémoire
+# sur Cloud Functions) saturerait la mémoire de l'instance. Il faut donc un dossier persistant sur disque.
+HTTP_CACHE_DIR = os.environ.get("HTTP_CACHE_DIR")
+HTTP_CACHE_TTL = float(os.environ.get("HTTP_CACHE_TTL", str(7 * 86400)))
+HTTP_CACHE_MAX_BYTES = int(os.environ.get("HTTP_CACHE_MAX_BYTES", str(1 << 30)))
+
+
+class TokenBucket:
+    """
+    Limiteur à jetons, partagé entre les threads : autorise `rate` requêtes par seconde
+    avec des rafales de `burst` requêtes.
+
+    Le débit est adaptatif : il est divisé par deux à chaque 429 (sans descendre sous `min_rate`)
+    puis remonte progressivement vers `rate` à chaque succès.
+    """
+
+    def __init__(self, rate, burst=None, min_rate=0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.burst = burst or max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        if delay > 0:
+            time.sleep(delay)
+
+    def throttled(self):
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+
+class HttpClient:
+    """
+    Envoie les requêtes GET avec un délai d'attente, des reprises à délai exponentiel aléatoire
+    (en respectant Retry-After) et un TokenBucket par hôte.
+
+    Les erreurs réseau et les codes de RETRY_STATUSES sont retentés `max_retries` fois ;
+    la dernière réponse (ou exception) est ensuite renvoyée à l'appelant.
+    Un corps lu en flux (iter_content) reprend là où il s'est arrêté si la connexion est coupée.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    # Erreurs levées pendant la lecture d'un corps en flux
+    STREAM_ERRORS = (
+        requests.exceptions.ChunkedEncodingError,
+        requests.exceptions.ConnectionError,
+        requests.exceptions.Timeout,
+    )
+
+    def __init__(
+        self,
+        timeout=HTTP_TIMEOUT,
+        max_retries=HTTP_MAX_RETRIES,
+        rate=HTTP_RATE,
+        backoff=0.5,
+        max_backoff=60.0,
+    ):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.rate = rate
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retries = 0
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        # None si le débit vers cet hôte n'est pas limité
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._buckets:
+                self._buckets[host] = TokenBucket(self.rate) if self.rate else None
+            return self._buckets[host]
+
+    def set_rate(self, url, rate):
+        """
+        Fixe le nombre maximal de requêtes par seconde vers l'hôte de `url`.
+
+        Args:
+            url (str): Une URL de l'hôte concerné.
+            rate (float): Requêtes par seconde, tous threads confondus (None pour ne pas limiter).
+        """
+        host = urlsplit(url).netloc
+        with self._lock:
+            self._buckets[host] = TokenBucket(rate) if rate else None
+
+    def _delay(self, attempt, response=None):
+        # Retry-After est prioritaire ; sinon "full jitter" : aléatoire entre 0 et backoff * 2^attempt
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(self.max_backoff, max(0.0, float(retry_after)))
+                except ValueError:
+                    try:
+                        when = parsedate_to_datetime(retry_after)
+                        return min(self.max_backoff, max(0.0, when.timestamp() - time.time()))
+                    except (TypeError, ValueError):
+                        pass
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2**attempt))
+
+    def get(self, url, session=None, **kwargs):
+        """
+        Envoie une requête GET en la retentant en cas d'échec temporaire.
+
+        Args:
+            url (str): L'URL demandée.
+            session (requests.Session): Session HTTP à réutiliser.
+            **kwargs: Transmis à requests.get (params, headers, stream, ...).
+
+        Returns:
+            requests.Response: La réponse obtenue.
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        bucket = self.bucket(url)
+        attempt = 0
+        while True:
+            if bucket:
+                bucket.acquire()
+            try:
+                response = (session or requests).get(url, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+                response = None
+            else:
+                if response.status_code not in self.RETRY_STATUSES:
+                    if bucket:
+                        bucket.succeeded()
+                    return response
+                if response.status_code == 429 and bucket:
+                    bucket.throttled()
+                if attempt >= self.max_retries:
+                    return response
+                response.close()
+
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+            self.retries += 1
+
+    def _resume(self, response, received, session=None):
+        # Redemande la suite du corps : Range si le serveur l'accepte et que le corps n'est pas compressé
+        # (les octets lus sont alors ceux transférés), sinon le corps entier dont on saute le début.
+        validator = response.headers.get("ETag") or response.headers.get("Last-Modified")
+        headers = {}
+        if (
+            validator
+            and response.headers.get("Accept-Ranges") == "bytes"
+            and response.headers.get("Content-Encoding", "identity") == "identity"
+        ):
+            # If-Range : le serveur renvoie le corps entier (200) s'il a changé entre-temps
+            headers = {"Range": f"bytes={received}-", "If-Range": validator}
+        retry = self.get(response.url, session=session, headers=headers, stream=True)
+
+        if retry.status_code == 206 and retry.headers.get("Content-Range", "").startswith(
+            f"bytes {received}-"
+        ):
+            return retry, 0
+        retry_validator = retry.headers.get("ETag") or retry.headers.get("Last-Modified")
+        if retry.status_code == 200 and retry_validator == validator:
+            return retry, received
+        retry.close()
+        raise requests.exceptions.ChunkedEncodingError(
+            f"Reprise impossible de {urlsplit(response.url).path} : le contenu a changé "
+            f"(code {retry.status_code})"
+        )
+
+    def iter_content(self, response, chunk_size=1 << 16, session=None):
+        """
+        Lit le corps d'une réponse demandée avec stream=True, morceau par morceau.
+        Si la connexion est coupée pendant la lecture, le téléchargement reprend à l'octet où il s'est arrêté,
+        au plus `max_retries` fois de suite sans progression.
+
+        Args:
+            response (requests.Response): La réponse à lire.
+            chunk_size (int): Taille en octets des morceaux renvoyés.
+            session (requests.Session): Session HTTP à réutiliser pour les reprises.
+
+        Yields:
+            bytes: Chaque morceau du corps de la réponse.
+
+        Raises:
+            requests.exceptions.RequestException: Si la lecture échoue encore après `max_retries` reprises,
+            ou si le contenu a changé sur le serveur entre deux reprises.
+        """
+        current = response
+        received = 0
+        skip = 0
+        attempt = 0
+        try:
+            while True:
+                failed_at = received
+                try:
+                    for chunk in current.iter_content(chunk_size=chunk_size):
+                        if skip:
+                            if len(chunk) <= skip:
+                                skip -= len(chunk)
+                                continue
+                            chunk = chunk[skip:]
+                            skip = 0
+                        received += len(chunk)
+                        yield chunk
+                    return
+                except self.STREAM_ERRORS:
+                    # Le compteur ne s'épuise que si les reprises n'avancent plus
+                    attempt = 0 if received > failed_at else attempt
+                    if attempt >= self.max_retries:
+                        raise
+                if current is not response:
+                    current.close()
+                time.sleep(self._delay(attempt))
+                attempt += 1
+                self.retries += 1
+                current, skip = self._resume(response, received, session=session)
+        finally:
+            if current is not response:
+                current.close()
+
+
+http_client = HttpClient()
+
+# ===================================================================================================
+# *                                         HTTP_CACHE
+# ===================================================================================================
+
+
+class HttpCache:
+    """
+    Cache disque des réponses HTTP, indexé par URL et paramètres.
+
+    Chaque requête envoie If-None-Match / If-Modified-Since d'après la réponse enregistrée :
+    sur un 304, le corps est relu depuis le disque au lieu d'être retéléchargé.
+    La taille du cache est suivie à chaque écriture : quand elle dépasse `max_bytes`, les entrées les moins
+    récemment utilisées sont supprimées jusqu'à 90 % de `max_bytes`. Les entrées non revalidées depuis `ttl`
+    secondes sont supprimées au même moment, ou au plus tard toutes les EVICT_EVERY écritures.
+    Sans dossier (directory None), le cache est désactivé et les requêtes sont simplement transmises.
+
+    Les fichiers ne portent que l'empreinte de l'URL : la clé d'API qu'elle contient n'est jamais écrite.
+    Une même instance peut servir plusieurs threads (voir crawl_events dans openagenda/api1.py).
+    """
+
+    # Nombre d'écritures entre deux purges des entrées expirées
+    EVICT_EVERY = 100
+
+    def __init__(
+        self, directory, ttl=HTTP_CACHE_TTL, max_bytes=HTTP_CACHE_MAX_BYTES, client=None
+    ):
+        self.directory = directory
+        self.client = client or http_client
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        # Taille totale des corps enregistrés, calculée au premier besoin puis tenue à jour
+        self._size = None
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(url, params=None):
+        prepared = requests.Request("GET", url, params=params).prepare()
+        return hashlib.sha256(prepared.url.encode("utf-8")).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + ".body", base + ".meta"
+
+    def _load_meta(self, key):
+        body_path, meta_path = self._paths(key)
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if time.time() - meta.get("stored_at", 0) > self.ttl or not os.path.exists(body_path):
+            return None
+        return meta
+
+    def _conditional_headers(self, meta):
+        headers = {}
+        if meta:
+            if meta.get("etag"):
+                headers["If-None-Match"] = meta["etag"]
+            if meta.get("last_modified"):
+                headers["If-Modified-Since"] = meta["last_modified"]
+        return headers
+
+    def _revalidated(self, key, meta):
+        # Un 304 repousse l'expiration de l'entrée et la marque comme récemment utilisée
+        meta["stored_at"] = time.time()
+        self._write_meta(key, meta)
+        self.hits += 1
+
+    def _write_meta(self, key, meta):
+        _, meta_path = self._paths(key)
+        tmp_path = f"{meta_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, meta_path)
+
+    def _store(self, key, response, chunks):
+        # Écrit le corps morceau par morceau dans un fichier temporaire, renommé une fois complet
+        body_path, _ = self._paths(key)
+        # Nom temporaire unique : plusieurs partitions peuvent télécharger le même flux en même temps
+        tmp_path = f"{body_path}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(self.directory, exist_ok=True)
+        complete = False
+        size = 0
+        try:
+            with open(tmp_path, "wb") as f:
+                for chunk in chunks:
+                    f.write(chunk)
+                    size += len(chunk)
+                    yield chunk
+            complete = True
+        finally:
+            if complete:
+                previous = os.path.getsize(body_path) if os.path.exists(body_path) else 0
+                os.replace(tmp_path, body_path)
+                self._write_meta(
+                    key,
+                    {
+                        "etag": response.headers.get("ETag"),
+                        "last_modified": response.headers.get("Last-Modified"),
+                        "stored_at": time.time(),
+                    },
+                )
+                self._stored(size - previous)
+            elif os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _stored(self, delta):
+        # Purge seulement si le cache déborde, ou périodiquement pour les entrées expirées
+        with self._lock:
+            self._writes += 1
+            if self._size is not None:
+                self._size += delta
+                if self._size <= self.max_bytes and self._writes % self.EVICT_EVERY:
+                    return
+            self._evict()
+
+    @staticmethod
+    def _cacheable(response):
+        return response.status_code == 200 and (
+            "ETag" in response.headers or "Last-Modified" in response.headers
+        )
+
+    def get(self, url, params=None, session=None, **kwargs):
+        """
+        Envoie une requête GET conditionnelle. Sur un 304, la réponse renvoyée porte le corps
+        enregistré et le code 200, comme si elle venait du serveur.
+
+        Args:
+            url (str): L'URL demandée.
+            params (dict): Paramètres de la requête.
+            session (requests.Session): Session HTTP à réutiliser.
+
+        Returns:
+            requests.Response: La réponse, servie depuis le cache si elle n'a pas changé.
+        """
+        if not self.directory:
+            return self.client.get(url, session=session, params=params, **kwargs)
+
+        key = self.key(url, params)
+        meta = self._load_meta(key)
+        headers = {**kwargs.pop("headers", {}), **self._conditional_headers(meta)}
+        response = self.client.get(
+            url, session=session, params=params, headers=headers, **kwargs
+        )
+
+        if response.status_code == 304 and meta:
+            with open(self._paths(key)[0], "rb") as f:
+                response._content = f.read()
+            response.status_code = 200
+            self._revalidated(key, meta)
+        elif self._cacheable(response):
+            self.misses += 1
+            for _ in self._store(key, response, [response.content]):
+                pass
+        return response
+
+    def iter_content(self, url, params=None, session=None, chunk_size=1 << 16, **kwargs):
+        """
+        Comme get, mais renvoie le corps morceau par morceau sans le charger en mémoire.
+        Le corps téléchargé n'est enregistré que s'il a été lu jusqu'au bout.
+
+        Args:
+            url (str): L'URL demandée.
+            params (dict): Paramètres de la requête.
+            session (requests.Session): Session HTTP à réutiliser.
+            chunk_size (int): Taille en octets des morceaux renvoyés.
+
+        Yields:
+            bytes: Chaque morceau du corps de la réponse.
+        """
+        key = self.key(url, params) if self.directory else None
+        meta = self._load_meta(key) if key else None
+        headers = {**kwargs.pop("headers", {}), **self._conditional_headers(meta)}
+        with self.client.get(
+            url, session=session, params=params, headers=headers, stream=True, **kwargs
+        ) as response:
+            if response.status_code == 304 and meta:
+                self._revalidated(key, meta)
+                with open(self._paths(key)[0], "rb") as f:
+                    yield from iter(lambda: f.read(chunk_size), b"")
+                return
+
+            response.raise_for_status()
+            chunks = self.client.iter_content(response, chunk_size=chunk_size, session=session)
+            if key and self._cacheable(response):
+                self.misses += 1
+                chunks = self._store(key, response, chunks)
+            yield from chunks
+
+    def evict(self):
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        # Supprime les entrées expirées et, si le cache déborde, les moins récemment utilisées
+        # jusqu'à 90 % de max_bytes, pour ne pas repurger à l'écriture suivante
+        entries = []
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            self._size = 0
+            return
+        for name in names:
+            if not name.endswith(".meta"):
+                continue
+            key = name[: -len(".meta")]
+            body_path, meta_path = self._paths(key)
+            try:
+                used = os.path.getmtime(meta_path)
+                size = os.path.getsize(body_path)
+            except OSError:
+                size = 0
+                used = 0
+            entries.append((used, size, key))
+
+        total = sum(size for _, size, _ in entries)
+        target = self.max_bytes if total <= self.max_bytes else self.max_bytes * 0.9
+        for used, size, key in sorted(entries):
+            if now - used <= self.ttl and total <= target:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+        self._size = total
+
+
+http_cache = HttpCache(HTTP_CACHE_DIR)
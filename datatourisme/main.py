@@ -13,6 +13,7 @@ from flask import jsonify                 # Utilisé pour formater les réponses
 from sklearn.metrics.pairwise import cosine_similarity # Utilisé pour calculer la similitude cosinus entre les échantillons pour déterminer la similitude des textes.
 from sklearn.feature_extraction.text import CountVectorizer # Transforme le texte en vecteur de tokens pour faciliter le calcul de la similarité.
 import numpy as np                        # Utilisé pour des calculs scientifiques et la manipulation de structures de données multidimensionnelles.
+from http_client import http_client       # Client HTTP partagé : délai d'attente, reprises et limitation par hôte.
 
 #===================================================================================================
 # *                                         VARIABLES
@@ -167,7 +168,7 @@ def fetch(url):
         data (dict): Un dictionnaire contenant les données du fichier JSON-LD.
     """
     # Récupéeration du fichier JSON-LD
-    response = requests.get(url)
+    response = http_client.get(url)
     data = response.json()
 
     # Sauvegarde du fichier JSON-LD dans un fichier data.jsonld
@@ -467,7 +468,7 @@ def search_images(keyword, api_key, cx):
         'searchType': 'image',
         'num': 10  # Nombre de résultats par requête
     }
-    response = requests.get(url, params=params)
+    response = http_client.get(url, params=params)
 
     # Si la requête a réussi, json() renverra un dictionnaire
     if response.status_code == 200:
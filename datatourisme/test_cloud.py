@@ -0,0 +1,235 @@
+import random
+from datetime import date, timedelta
+
+import numpy as np
+import pytest
+import requests
+
+import cloud
+
+
+def random_events(count, seed=0):
+    # Peu de villes et de mots : beaucoup de paires proches du seuil
+    rng = random.Random(seed)
+    villes = ["Lyon", "Nantes", "Brest", "Albi"]
+    mots = ["fete", "de", "la", "musique", "marche", "noel", "concert", "jazz", "foire", "vins", "bal", "feu"]
+    events = []
+    for _ in range(count):
+        debut = date(2024, 1, 1) + timedelta(days=rng.randrange(90))
+        fin = debut + timedelta(days=rng.randrange(6))
+        events.append(
+            {
+                "titre": " ".join(rng.sample(mots, rng.randint(2, 5))),
+                "ville": rng.choice(villes),
+                "date_debut": debut.isoformat(),
+                "date_fin": fin.isoformat(),
+            }
+        )
+    return events
+
+
+def brute_force_pairs(events, threshold):
+    i, j = np.triu_indices(len(events), k=1)
+    pairs = np.stack((i, j), axis=1)
+    scores = cloud.score_event_pairs(cloud.event_arrays(events), pairs)
+    return {(int(a), int(b)) for a, b in pairs[scores >= threshold]}
+
+
+def test_score_event_pairs_matches_event_similarity():
+    events = random_events(50)
+    pairs = np.array([(i, j) for i in range(10) for j in range(i + 1, 50)])
+    scores = cloud.score_event_pairs(cloud.event_arrays(events), pairs)
+    for (i, j), score in zip(pairs, scores):
+        assert score == pytest.approx(cloud.event_similarity(events[i], events[j]))
+
+
+@pytest.mark.parametrize("threshold", [0.8, 0.85, 0.9])
+def test_near_duplicate_finder_matches_brute_force(threshold):
+    events = random_events(600)
+    expected = brute_force_pairs(events, threshold)
+    found = {(i, j) for i, j, _ in cloud.NearDuplicateFinder(threshold=threshold).find(events)}
+    assert expected
+    assert found == expected
+
+
+def test_near_duplicate_finder_spans_max_start_gap():
+    finder = cloud.NearDuplicateFinder(threshold=0.8)
+    assert finder.max_start_gap == 24
+    # Même titre, même ville, même fin : 23 jours d'écart au début atteignent encore le seuil
+    events = [
+        {"titre": "fete du jazz", "ville": "Albi", "date_debut": "2024-03-01", "date_fin": "2024-03-25"},
+        {"titre": "fete du jazz", "ville": "Albi", "date_debut": "2024-03-24", "date_fin": "2024-03-25"},
+    ]
+    assert [(i, j) for i, j, _ in finder.find(events)] == [(0, 1)]
+
+
+def test_categorize_festivals_matches_categorize_festival():
+    rng = random.Random(4)
+    mots = ["Fête", "fête", "du", "de", "la", "l'ail", "vin", "jambon", "village", "global", "fest-noz", "marché", "x"]
+    titles = [" ".join(rng.choices(mots, k=rng.randint(0, 4))) for _ in range(300)] + [None, "", "fête\tdu\nvin"]
+    descriptions = [" ".join(rng.choices(mots, k=rng.randint(0, 30))) for _ in range(300)] + ["fête du vin", None, ""]
+    expected = [cloud.categorize_festival(title, description) for title, description in zip(titles, descriptions)]
+    assert list(cloud.categorize_festivals(titles, descriptions)) == expected
+
+
+def random_geo_index(count, seed=0, cell_deg=0.5):
+    rng = np.random.default_rng(seed)
+    # Points uniformes sur la sphère, plus une grappe près de chaque pôle
+    latitudes = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    latitudes[: count // 10] = rng.uniform(80, 90, count // 10)
+    latitudes[count // 10 : count // 5] = rng.uniform(-90, -80, count // 10)
+    longitudes = rng.uniform(-180, 180, count)
+    ids = [f"e{i}" for i in range(count)]
+    days = np.zeros(count, dtype=np.int64)
+    return cloud.GeoIndex(ids, latitudes, longitudes, days, days, cell_deg=cell_deg)
+
+
+def brute_force_within(index, latitude, longitude, radius_km):
+    distances = index._distances(np.arange(len(index)), latitude, longitude)
+    return {str(index.ids[i]) for i in np.flatnonzero(distances <= radius_km)}
+
+
+@pytest.mark.parametrize("radius_km", [30, 300, 1000, 2000, 8000])
+def test_geo_index_within_matches_brute_force(radius_km):
+    index = random_geo_index(3000)
+    rng = np.random.default_rng(1)
+    queries = [(89.5, 10.0), (-88.0, -170.0), (75.0, 179.9), (0.0, -180.0)]
+    queries += list(zip(rng.uniform(-90, 90, 40), rng.uniform(-180, 180, 40)))
+    for latitude, longitude in queries:
+        found = {event_id for event_id, _ in index.within(latitude, longitude, radius_km)}
+        assert found == brute_force_within(index, latitude, longitude, radius_km), (latitude, longitude)
+
+
+def test_geo_index_nearest_matches_brute_force():
+    # Peu de points : le rayon de recherche doit beaucoup grandir avant d'en trouver k
+    index = random_geo_index(200, seed=2, cell_deg=0.1)
+    rng = np.random.default_rng(3)
+    for latitude, longitude in zip(rng.uniform(-90, 90, 30), rng.uniform(-180, 180, 30)):
+        distances = index._distances(np.arange(len(index)), latitude, longitude)
+        expected = np.sort(distances)[:5]
+        found = [distance for _, distance in index.nearest(latitude, longitude, k=5)]
+        assert found == pytest.approx(expected.tolist())
+
+
+def feed_node(i):
+    # Noeud "@graph" minimal accepté par adapt_event, avec sa région (pas de recherche pgeocode)
+    return {
+        "@id": f"https://data.datatourisme.fr/{i}",
+        "rdfs:label": {"@value": f"Fête du village {i}"},
+        "schema:startDate": [{"@value": "2099-07-14"}],
+        "schema:endDate": [{"@value": "2099-07-15"}],
+        "isLocatedAt": {
+            "schema:address": {
+                "schema:addressLocality": "Albi",
+                "schema:postalCode": "81000",
+                "hasAddressCity": {"isPartOfRegion": {"rdfs:label": {"@value": "Occitanie"}}},
+            }
+        },
+    }
+
+
+class RecordingWriter(cloud.EventWriter):
+    # Remplace BigQueryWriter : garde toutes les lignes envoyées, par lots de max_rows
+    def __init__(self, sent, max_rows):
+        super().__init__()
+        self.sent = sent
+        self.max_rows = max_rows
+        self._rows = []
+
+    def insert(self, row):
+        self._rows.append(row)
+        if len(self._rows) >= self.max_rows:
+            self.flush()
+        return []
+
+    def flush(self):
+        rows, self._rows = self._rows, []
+        if rows:
+            self.requests += 1
+            self.sent.extend(rows)
+            self._succeeded(rows)
+        return []
+
+
+@pytest.fixture
+def feed(monkeypatch, tmp_path):
+    # Flux de `count` noeuds, coupé (erreur réseau) avant le noeud `fail_at` si indiqué
+    state = {"count": 10, "fail_at": None}
+
+    def stream_graph(url):
+        for i in range(state["count"]):
+            if i == state["fail_at"]:
+                raise requests.exceptions.ConnectionError("connexion coupée")
+            yield feed_node(i)
+
+    index_path = tmp_path / "evenement_sources.idx"
+    cloud.DedupeIndex().save(str(index_path))
+    monkeypatch.setattr(cloud, "stream_graph", stream_graph)
+    monkeypatch.setattr(cloud, "DEDUPE_INDEX_PATH", str(index_path))
+    monkeypatch.setattr(cloud, "DATE_INDEX_PATH", None)
+    return state
+
+
+def test_interrupted_run_records_sent_rows(feed):
+    sent = []
+    feed["fail_at"] = 7
+    with pytest.raises(requests.exceptions.ConnectionError):
+        cloud.process_event_data("https://flux", batch_size=2, writer=RecordingWriter(sent, max_rows=2))
+    assert sent
+
+    feed["fail_at"] = None
+    cloud.process_event_data("https://flux", batch_size=2, writer=RecordingWriter(sent, max_rows=2))
+    sources = [row["source"] for row in sent]
+    assert sorted(sources) == sorted(set(sources))
+    assert len(sources) == 10
+
+
+def test_resumed_run_skips_rows_sent_before_the_interruption(feed, tmp_path):
+    sent = []
+    checkpoint_path = str(tmp_path / "checkpoint.json")
+    feed["count"], feed["fail_at"] = 25, 17
+    with pytest.raises(requests.exceptions.ConnectionError):
+        cloud.process_event_data(
+            "https://flux",
+            batch_size=2,
+            writer=RecordingWriter(sent, max_rows=2),
+            checkpoint_path=checkpoint_path,
+            checkpoint_every=5,
+        )
+    assert cloud.Checkpoint.load(checkpoint_path, "https://flux#0/1").offset == 15
+
+    feed["fail_at"] = None
+    cloud.process_event_data(
+        "https://flux",
+        batch_size=2,
+        writer=RecordingWriter(sent, max_rows=2),
+        checkpoint_path=checkpoint_path,
+        checkpoint_every=5,
+    )
+    sources = [row["source"] for row in sent]
+    assert sorted(sources) == sorted(set(sources))
+    assert len(sources) == 25
+
+
+def test_parallel_run_uses_one_pool_for_all_segments(feed, tmp_path, monkeypatch):
+    pools = []
+    pool_class = cloud.multiprocessing.Pool
+
+    def counting_pool(*args, **kwargs):
+        pools.append(pool_class(*args, **kwargs))
+        return pools[-1]
+
+    monkeypatch.setattr(cloud.multiprocessing, "Pool", counting_pool)
+    sent = []
+    feed["count"] = 25
+    cloud.process_event_data(
+        "https://flux",
+        batch_size=2,
+        writer=RecordingWriter(sent, max_rows=2),
+        workers=2,
+        ordered=False,
+        checkpoint_path=str(tmp_path / "checkpoint.json"),
+        checkpoint_every=5,
+    )
+    assert len(pools) == 1
+    assert sorted(row["source"] for row in sent) == sorted(feed_node(i)["@id"] for i in range(25))
@@ -3,11 +3,30 @@
 #===================================================================================================
 
 import json
+import os
+import queue
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
 import requests
+from requests.adapters import HTTPAdapter
+
+# Client HTTP et cache partagés avec datatourisme/cloud.py : un seul module, datatourisme/http_client.py
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "datatourisme"))
+from http_client import http_cache, http_client
+
+def _after_param(params, after):
+    # L'API renvoie le curseur "after" sous forme de liste, à renvoyer tel quel en after[]
+    if isinstance(after, list):
+        params["after[]"] = after
+    else:
+        params["after"] = after
 
-def get_agendas(key, size=100, after=None, fields=None, filters=None, sort=None):
+def get_agendas(key, size=100, after=None, fields=None, filters=None, sort=None, session=None):
     url = "https://api.openagenda.com/v2/agendas"
-    params = {"key": key, "size": size, "after": after}
+    params = {"key": key, "size": size}
+    _after_param(params, after)
 
     if fields:
         params["fields"] = fields
@@ -19,7 +38,7 @@ def get_agendas(key, size=100, after=None, fields=None, filters=None, sort=None)
     if sort:
         params["sort"] = sort
 
-    response = requests.get(url, params=params)
+    response = http_cache.get(url, params=params, session=session)
     data = response.json()
 
     if response.status_code == 200:
@@ -28,12 +47,12 @@ def get_agendas(key, size=100, after=None, fields=None, filters=None, sort=None)
         print("Error: Failed to retrieve agendas.")
         return None
 
-def get_events(agenda_uid, key, after=None, detailed=False, from_index=None, size=20, include_labels=None, include_fields=None, monolingual=None):
+def get_events(agenda_uid, key, after=None, detailed=False, from_index=None, size=20, include_labels=None, include_fields=None, monolingual=None, session=None):
     url = f"https://api.openagenda.com/v2/agendas/{agenda_uid}/events"
     params = {"key": key}
 
     if after:
-        params["after"] = after
+        _after_param(params, after)
 
     if detailed:
         params["detailed"] = 1
@@ -53,7 +72,7 @@ def get_events(agenda_uid, key, after=None, detailed=False, from_index=None, siz
     if monolingual:
         params["monolingual"] = monolingual
 
-    response = requests.get(url, params=params)
+    response = http_cache.get(url, params=params, session=session)
     data = response.json()
 
     if response.status_code == 200:
@@ -62,36 +81,215 @@ def get_events(agenda_uid, key, after=None, detailed=False, from_index=None, siz
         print("Error: Failed to retrieve events.")
         return None
 
+#===================================================================================================
+# *                                         PAGINATION
+#===================================================================================================
+
+def _paginate(fetch_page, items_key, max_items=None, max_pages=None):
+    # Appelle fetch_page(after) en suivant le curseur "after" renvoyé par l'API, page après page
+    after = None
+    pages = 0
+    items = 0
+    while max_pages is None or pages < max_pages:
+        data = fetch_page(after)
+        pages += 1
+        if not data or not data.get(items_key):
+            return
+        for item in data[items_key]:
+            if max_items is not None and items >= max_items:
+                return
+            items += 1
+            yield item
+        after = data.get("after")
+        if not after:
+            return
+
+def iter_agendas(key, size=100, fields=None, filters=None, sort=None, max_items=None, max_pages=None, session=None):
+    """
+    Renvoie un à un tous les agendas, en parcourant les pages de l'API avec le curseur "after".
+    Une seule page est en mémoire à la fois.
+
+    Args:
+        key (str): La clé de l'API OpenAgenda.
+        size (int): Nombre d'agendas par page.
+        fields, filters, sort: Transmis à get_agendas.
+        max_items (int): Nombre maximal d'agendas renvoyés (None pour tous).
+        max_pages (int): Nombre maximal de pages demandées (None pour toutes).
+        session (requests.Session): Session HTTP à réutiliser.
+
+    Yields:
+        dict: Chaque agenda.
+    """
+    return _paginate(
+        lambda after: get_agendas(key, size, after, fields, filters, sort, session=session),
+        "agendas",
+        max_items,
+        max_pages,
+    )
+
+def iter_events(agenda_uid, key, size=100, detailed=False, include_labels=None, include_fields=None, monolingual=None, max_items=None, max_pages=None, session=None):
+    """
+    Renvoie un à un tous les événements d'un agenda, en parcourant les pages de l'API avec le curseur "after".
+    Une seule page est en mémoire à la fois.
+
+    Args:
+        agenda_uid (int): L'identifiant de l'agenda.
+        key (str): La clé de l'API OpenAgenda.
+        size (int): Nombre d'événements par page.
+        detailed, include_labels, include_fields, monolingual: Transmis à get_events.
+        max_items (int): Nombre maximal d'événements renvoyés (None pour tous).
+        max_pages (int): Nombre maximal de pages demandées (None pour toutes).
+        session (requests.Session): Session HTTP à réutiliser.
+
+    Yields:
+        dict: Chaque événement.
+    """
+    return _paginate(
+        lambda after: get_events(
+            agenda_uid,
+            key,
+            after=after,
+            detailed=detailed,
+            size=size,
+            include_labels=include_labels,
+            include_fields=include_fields,
+            monolingual=monolingual,
+            session=session,
+        ),
+        "events",
+        max_items,
+        max_pages,
+    )
+
+#===================================================================================================
+# *                                         CRAWLER
+#===================================================================================================
+
+def make_session(pool_size=10):
+    """
+    Crée une session HTTP dont les connexions (keep-alive) sont réutilisées entre les requêtes et les threads.
+
+    Args:
+        pool_size (int): Nombre maximal de connexions ouvertes vers un même hôte.
+
+    Returns:
+        requests.Session: La session.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+def crawl_events(key, concurrency=8, rate=10, size=100, agenda_filters=None, session=None):
+    """
+    Récupère les événements de tous les agendas, plusieurs agendas à la fois, en suivant les curseurs "after"
+    jusqu'à la dernière page. Les événements sont renvoyés au fur et à mesure de leur arrivée.
+
+    Args:
+        key (str): La clé de l'API OpenAgenda.
+        concurrency (int): Nombre d'agendas récupérés en parallèle.
+        rate (float): Nombre maximal de requêtes par seconde vers l'API, tous threads confondus (None pour ne pas
+            limiter). Appliqué au limiteur de http_client pour cet hôte.
+        size (int): Nombre d'éléments par page.
+        agenda_filters (dict): Filtres transmis à get_agendas.
+        session (requests.Session): Session HTTP partagée, créée avec make_session si None.
+
+    Yields:
+        tuple: (uid de l'agenda, événement).
+
+    Raises:
+        Exception: Toute erreur autre qu'une erreur réseau survenue en récupérant un agenda ; les autres agendas
+            sont alors abandonnés.
+    """
+    session = session or make_session(concurrency)
+    http_client.set_rate("https://api.openagenda.com", rate)
+    results = queue.Queue(maxsize=concurrency * size)
+    stop = threading.Event()
+    done = object()
+
+    def put(item):
+        # Bloque tant que le consommateur est en retard, sauf s'il a abandonné
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def crawl_agenda(agenda_uid):
+        try:
+            for event in iter_events(agenda_uid, key, size=size, session=session):
+                if not put((agenda_uid, event)):
+                    return
+        except requests.exceptions.RequestException as e:
+            print(f"Error: Failed to retrieve events of agenda {agenda_uid}: {e}")
+        except Exception as e:
+            # Erreur inattendue (réponse mal formée, bug) : relevée chez le consommateur plutôt que perdue
+            # dans un Future jamais lu, ce qui terminerait l'agenda en silence
+            put(e)
+        finally:
+            put(done)
+
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    pending = 0
+
+    def drain(block):
+        nonlocal pending
+        while pending:
+            try:
+                item = results.get(block=block)
+            except queue.Empty:
+                return
+            if item is done:
+                pending -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+
+    try:
+        for agenda in iter_agendas(key, size=size, filters=agenda_filters, session=session):
+            executor.submit(crawl_agenda, agenda["uid"])
+            pending += 1
+            # Les événements déjà arrivés sont renvoyés pendant la lecture des agendas
+            yield from drain(block=False)
+
+        yield from drain(block=True)
+    finally:
+        stop.set()
+        executor.shutdown(wait=True, cancel_futures=True)
+
 if __name__ == '__main__':
     # Exemple d'utilisation
     key = "5e04ebf3b96e413499d131af52874360"
     size = 100
-    after = None
     fields = ["summary"]
     filters = {"search": "", "official": 1}
     sort = "createdAt.desc"
 
-    agendas_data = get_agendas(key, size, after, fields, filters, sort)
+    session = make_session()
 
-    # Save agendas_data to a JSON file
-    with open('agendas_data.json', 'w') as file:
-        json.dump(agendas_data, file)
+    # Les agendas et les événements sont écrits au fur et à mesure : un seul agenda est en mémoire à la fois
+    with open('agendas_data.json', 'w') as agendas_file, open('events_data.json', 'w') as events_file:
+        agendas_file.write("[")
+        events_file.write("[")
 
-    if agendas_data:
-        # Traitement des données des agendas
-        for agenda in agendas_data["agendas"]:
+        for index, agenda in enumerate(iter_agendas(key, size, fields, filters, sort, session=session)):
             print(f"Agenda: {agenda['uid']}")
             agenda_uid = agenda["uid"]
-            events_data = get_events(agenda_uid, key)
-            if events_data and "events" in events_data:
-                # Traitement des données des événements
-                for event in events_data["events"]:
-                    print(f"Event: {event['uid']} - {event['title']}")
+
+            # Traitement des données des événements
+            events = []
+            for event in iter_events(agenda_uid, key, session=session):
+                print(f"Event: {event['uid']} - {event['title']}")
+                events.append(event)
             print("--------------------")
 
-    # Save events_data to a JSON file
-    with open('events_data.json', 'w') as file:
-        json.dump(events_data, file)
+            separator = "," if index else ""
+            agendas_file.write(separator + json.dumps(agenda))
+            events_file.write(separator + json.dumps({"agenda": agenda_uid, "events": events}))
 
-    
-    
+        agendas_file.write("]")
+        events_file.write("]")